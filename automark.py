@@ -5,8 +5,11 @@ Fetch one or more Flickr albums. Run with --help for details
 
 import argparse
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
 
-from image_processors import Watermarker
+from image_processors import Watermarker, WatermarkPool
+from image_processors.watermarker import (DEFAULT_ENCODER_PROFILE,
+                                          ENCODER_PROFILES, Rendition)
 from phetch_tools import load_config
 
 
@@ -22,11 +25,28 @@ def parse_cli_args() -> argparse.Namespace:
     )
     parser.add_argument('dir', help='Directory containing files to watermark')
     parser.add_argument('--limit', required=False, help='Max images to process', type=int, default=0)
-    parser.add_argument('--resize', required=False, help='Resize to fit box', type=int, dest='max_edge')
+    parser.add_argument('--resize', required=False, help='Resize to fit box; a comma-separated list of sizes '
+                                                         'makes one copy per size', type=parse_sizes,
+                        dest='max_edges')
+    parser.add_argument('--jobs', required=False, help='Number of images to process at once', type=int, default=1)
+    parser.add_argument('--encoder-profile', required=False, help='Encoding for watermarked images; see README.md',
+                        choices=list(ENCODER_PROFILES), default=DEFAULT_ENCODER_PROFILE)
     args = parser.parse_args()
     return args
 
 
+def parse_sizes(value: str) -> List[int]:
+    """
+    Parse a comma-separated list of sizes
+    :param value:
+    :return:
+    """
+    try:
+        return [int(size) for size in value.split(',')]
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f'{value} is not a comma-separated list of sizes') from err
+
+
 def run_cli() -> None:
     """
     Run the script from the CLI
@@ -38,31 +58,64 @@ def run_cli() -> None:
     watermark = Path(config['watermark']['file'])
     if not watermark.is_absolute():
         watermark = script_dir / watermark
-    watermarker = Watermarker(str(watermark))
-    if 'opacity' in config['watermark']:
-        watermarker.set_watermark_opacity(config['watermark']['opacity'])
+    opacity = config['watermark']['opacity'] if 'opacity' in config['watermark'] else None
 
     source_dir = Path(args.dir.rstrip('/'))
-    output_dir = source_dir / ('watermarked' + ('-' + str(args.max_edge) if args.max_edge else ''))
-    if not output_dir.is_dir():
-        print(f'Output dir {output_dir} did not exist, creating it')
-        output_dir.mkdir(parents=True)
+    max_edges: List[Optional[int]] = list(args.max_edges) if args.max_edges else [None]
+    todo = find_renditions_to_make(source_dir, max_edges, args.encoder_profile)
+    if args.limit:
+        todo = todo[:args.limit]
 
-    source_files = list(source_dir.glob('*.jpg')) + list(source_dir.glob('*.jpeg'))
-    done = 0
-    for image in source_files:
-        output = output_dir / image.name
-        if output.exists():
-            pass
-        else:
-            print(f"Watermarking {image} => {output}")
-            watermarker.copy_with_watermark(str(image), str(output), args.max_edge)
-            done += 1
-            if args.limit and (done >= args.limit):
-                break
+    watermarker: Union[Watermarker, WatermarkPool]
+    if args.jobs > 1:
+        with WatermarkPool(str(watermark), opacity, args.jobs, encoder_profile=args.encoder_profile) as watermarker:
+            for image, renditions in todo:
+                print(f"Watermarking {image} => {', '.join(output for _, output in renditions)}")
+                watermarker.submit_renditions(str(image), renditions)
+    else:
+        watermarker = Watermarker(str(watermark))
+        if opacity:
+            watermarker.set_watermark_opacity(opacity)
+        watermarker.set_encoder_profile(args.encoder_profile)
+        for image, renditions in todo:
+            print(f"Watermarking {image} => {', '.join(output for _, output in renditions)}")
+            watermarker.copy_with_watermark_renditions(str(image), renditions)
 
+    if watermarker.encode_stats.totals:
+        print(watermarker.encode_stats.report())
     print('All done')
 
 
+def find_renditions_to_make(source_dir: Path, max_edges: List[Optional[int]],
+                            encoder_profile: str = DEFAULT_ENCODER_PROFILE) -> List[Tuple[Path, List[Rendition]]]:
+    """
+    List the source images that still need copies at any of the given sizes, and the copies each needs
+    :param source_dir:
+    :param max_edges:
+    :param encoder_profile: Copies are named for its format; JPEG copies keep the source file name
+    :return:
+    """
+    output_dirs: Dict[Optional[int], Path] = {}
+    existing: Dict[Optional[int], Set[str]] = {}
+    for max_edge in max_edges:
+        output_dir = source_dir / ('watermarked' + ('-' + str(max_edge) if max_edge else ''))
+        if not output_dir.is_dir():
+            print(f'Output dir {output_dir} did not exist, creating it')
+            output_dir.mkdir(parents=True)
+        output_dirs[max_edge] = output_dir
+        existing[max_edge] = {entry.name for entry in output_dir.iterdir()}  # one listing rather than a stat per file
+
+    source_files = list(source_dir.glob('*.jpg')) + list(source_dir.glob('*.jpeg'))
+    todo: List[Tuple[Path, List[Rendition]]] = []
+    profile = ENCODER_PROFILES[encoder_profile]
+    for image in source_files:
+        output_name = image.name if profile['format'] == 'JPEG' else image.stem + profile['extension']
+        renditions: List[Rendition] = [(max_edge, str(output_dirs[max_edge] / output_name))
+                                       for max_edge in max_edges if output_name not in existing[max_edge]]
+        if renditions:
+            todo.append((image, renditions))
+    return todo
+
+
 if __name__ == '__main__':
     run_cli()
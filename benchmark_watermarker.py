@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+"""
+Benchmark Watermarker on synthetic images, stage by stage. Run with --help for details
+"""
+
+import argparse
+import json
+import math
+import platform
+import resource
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+from multiprocessing import get_context
+from os import cpu_count
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+import PIL
+import pyexiv2
+from PIL import Image, ImageDraw
+from PIL.ImageFile import ImageFile
+from typing_extensions import TypedDict
+
+from automark import parse_sizes
+from image_processors import Watermarker
+from image_processors.watermarker import (DEFAULT_ENCODER_PROFILE,
+                                          ENCODER_PROFILES, add_metadata,
+                                          read_metadata, standard_save)
+
+STAGES = ['decode', 'metadata_read', 'brightness', 'tile_prep', 'composite', 'encode', 'metadata_write']
+ORIENTATIONS = ['landscape', 'portrait']
+CORNERS = ['bright', 'dark']
+OPERATIONS = ['watermark_image', 'mark_in_place', 'copy_with_watermark']
+MIN_TIME_CHANGE = 0.002  # seconds; smaller differences are treated as noise when comparing runs
+BICUBIC = getattr(Image, 'Resampling', Image).BICUBIC  # Image.Resampling from Pillow 9.1; constants on Image before
+
+Case = Tuple[int, str, str]  # megapixels, orientation, corner
+Result = Dict[str, Any]
+T = TypeVar('T')
+BenchmarkSettings = TypedDict(
+    'BenchmarkSettings', {'watermark_file': str, 'encoder_profile': str, 'repeat': int, 'max_edge': int}
+)
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Time each stage of watermarking synthetic JPEGs, and the peak memory used',
+    )
+    parser.add_argument('--sizes', help='Comma-separated list of image sizes, in megapixels', type=parse_sizes,
+                        default=[12, 24, 45, 100])
+    parser.add_argument('--repeat', help='Times to repeat each measurement; the median is reported', type=int,
+                        default=3)
+    parser.add_argument('--encoder-profile', help='Encoder profile to benchmark', choices=list(ENCODER_PROFILES),
+                        default=DEFAULT_ENCODER_PROFILE)
+    parser.add_argument('--max-edge', help='Size to resize to when timing copy_with_watermark', type=int,
+                        default=2048)
+    parser.add_argument('--work-dir', help='Directory to keep generated images in between runs; '
+                                           'a temporary directory is used by default')
+    parser.add_argument('--output', help='File to write JSON results to', default='watermark-benchmark.json')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', help='Percentage slowdown to report as a regression when comparing',
+                        type=float, default=10.0)
+    args = parser.parse_args()
+    return args
+
+
+def run_cli() -> None:
+    """
+    Run the script from the CLI
+    :return:
+    """
+    args = parse_cli_args()
+    cases = [(megapixels, orientation, corner)
+             for megapixels in args.sizes for orientation in ORIENTATIONS for corner in CORNERS]
+
+    if args.work_dir:
+        Path(args.work_dir).mkdir(parents=True, exist_ok=True)
+        results = run_benchmarks(cases, Path(args.work_dir), args)
+    else:
+        with TemporaryDirectory() as work_dir:
+            results = run_benchmarks(cases, Path(work_dir), args)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': cpu_count(),
+            'repeat': args.repeat,
+            'encoder_profile': args.encoder_profile,
+            'max_edge': args.max_edge,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='UTF-8') as json_out:
+        json.dump(report, json_out, indent=2)
+    print(f'Wrote results to {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as json_in:
+            previous = json.load(json_in)
+        regressions = compare_results(previous['results'], results, args.threshold)
+        if regressions:
+            print(f'{regressions} measurements regressed by more than {args.threshold}%')
+            sys.exit(1)
+
+
+def run_benchmarks(cases: List[Case], work_dir: Path, args: argparse.Namespace) -> Dict[str, Result]:
+    """
+    Generate any missing test images, then benchmark each case.
+    Everything runs in a fresh process, so that each measurement's peak memory is its own; on Linux, a child's
+    peak starts from its parent's, so nothing memory-hungry can run in this one.
+    :param cases:
+    :param work_dir:
+    :param args:
+    :return: Results keyed by case name
+    """
+    watermark_file = work_dir / 'watermark.png'
+    if not watermark_file.exists():
+        make_test_watermark(watermark_file)
+
+    settings: BenchmarkSettings = {'watermark_file': str(watermark_file), 'encoder_profile': args.encoder_profile,
+                                   'repeat': args.repeat, 'max_edge': args.max_edge}
+    results: Dict[str, Result] = {}
+    for case in cases:
+        name = case_name(case)
+        image_file = work_dir / f'{name}.jpg'
+        if not image_file.exists():
+            print(f'Generating {image_file}')
+            run_in_fresh_process(make_test_image, image_file, *case)
+
+        print(f'Benchmarking {name}')
+        result = run_in_fresh_process(time_stages, str(image_file), settings)
+        result['operations'] = {
+            operation: run_in_fresh_process(time_operation, operation, str(image_file), settings)
+            for operation in OPERATIONS
+        }
+        print_result(name, result)
+        results[name] = result
+    return results
+
+
+def case_name(case: Case) -> str:
+    """
+    Name a benchmark case, eg 24MP-portrait-dark
+    :param case:
+    :return:
+    """
+    megapixels, orientation, corner = case
+    return f'{megapixels}MP-{orientation}-{corner}'
+
+
+def make_test_watermark(watermark_file: Path) -> None:
+    """
+    Draw a white-on-transparent watermark, like the ones Watermarker expects
+    :param watermark_file:
+    :return:
+    """
+    watermark = Image.new('RGBA', (1200, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark)
+    draw.rectangle((10, 10, 1189, 289), outline=(255, 255, 255, 255), width=16)
+    draw.ellipse((450, 60, 750, 240), fill=(255, 255, 255, 200))
+    watermark.save(watermark_file)
+
+
+def make_test_image(image_file: Path, megapixels: int, orientation: str, corner: str) -> None:
+    """
+    Generate a 3:2 JPEG with smooth colour, film-like grain and EXIF, IPTC and XMP metadata.
+    The bottom right corner is made bright or dark to exercise both watermark colours.
+    :param image_file:
+    :param megapixels:
+    :param orientation: landscape or portrait
+    :param corner: bright or dark
+    :return:
+    """
+    long_edge = round(math.sqrt(megapixels * 1_000_000 * 1.5))
+    short_edge = round(long_edge / 1.5)
+    size = (long_edge, short_edge) if orientation == 'landscape' else (short_edge, long_edge)
+
+    colours = Image.merge('RGB', [Image.effect_noise((6, 6), 64) for _ in range(3)])
+    image = colours.resize(size, BICUBIC)
+    corner_box = (size[0] * 2 // 3, size[1] * 2 // 3, size[0], size[1])
+    corner_colour = (235, 232, 225) if corner == 'bright' else (30, 32, 38)
+    image.paste(corner_colour, corner_box)
+    grain = Image.effect_noise(size, 32)
+    image = Image.blend(image, Image.merge('RGB', (grain, grain, grain)), 0.2)
+
+    exif = Image.Exif()
+    exif[0x010F] = 'Benchmark'  # Make
+    exif[0x0110] = 'Synthetic'  # Model
+    exif[0x013B] = 'benchmark_watermarker.py'  # Artist
+    image.save(image_file, quality=92, exif=exif.tobytes())
+
+    exiv_image = pyexiv2.Image(str(image_file))
+    exiv_image.modify_iptc({'Iptc.Application2.ObjectName': 'Synthetic test image',
+                            'Iptc.Application2.Keywords': ['benchmark', 'synthetic']})
+    exiv_image.modify_xmp({'Xmp.dc.title': 'Synthetic test image'})
+    exiv_image.close()
+
+
+def run_in_fresh_process(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a benchmark function in a newly spawned process and return its result
+    :param func:
+    :param args:
+    :param kwargs:
+    :return:
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(func, *args, **kwargs).result()
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process so far, in MB
+    :return:
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / 1024 if sys.platform == 'darwin' else max_rss / 1024  # bytes on macOS, KB on Linux
+
+
+def time_stages(image_file: str, settings: BenchmarkSettings) -> Result:
+    """
+    Time each stage of watermarking an image, as Watermarker.mark_in_place does them
+    :param image_file:
+    :param settings:
+    :return: Median time of each stage, with baseline and peak memory
+    """
+    watermarker = Watermarker(settings['watermark_file'])
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    baseline_rss = peak_rss_mb()
+    for _ in range(settings['repeat']):
+        watermarker.tile_cache.clear()  # time preparing the tile, not fetching it
+        image = watermark_by_stages(watermarker, image_file, settings['encoder_profile'], timings)
+
+    return {
+        'width': image.width,
+        'height': image.height,
+        'stages': {stage: median(times) for stage, times in timings.items()},
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def watermark_by_stages(watermarker: Watermarker, image_file: str, encoder_profile: str,
+                        timings: Dict[str, List[float]]) -> ImageFile:
+    """
+    Watermark an image step by step, adding the time of each stage to timings
+    :param watermarker:
+    :param image_file:
+    :param encoder_profile:
+    :param timings:
+    :return: The watermarked image
+    """
+    with timed(timings, 'decode'):
+        image_data = Path(image_file).read_bytes()
+        image: ImageFile = Image.open(BytesIO(image_data))
+        image.load()
+
+    with timed(timings, 'metadata_read'):
+        metadata = read_metadata(image_data)
+
+    with timed(timings, 'brightness'):
+        dimensions = watermarker.calculate_watermark_dimensions(image)
+        position = (image.width - dimensions[0] - dimensions[2], image.height - dimensions[1] - dimensions[3])
+        area_is_bright = watermarker.watermark_area_is_bright(image, *position)
+
+    with timed(timings, 'tile_prep'):
+        local_watermark = watermarker.prepare_pastable_watermark(dimensions[0], dimensions[1], dark=area_is_bright)
+
+    with timed(timings, 'composite'):
+        image = watermarker.apply_prepared_watermark(image, local_watermark, position)
+
+    with timed(timings, 'encode'):
+        buffer = BytesIO()
+        standard_save(image, buffer, encoder_profile)
+
+    with timed(timings, 'metadata_write'):
+        add_metadata(buffer.getvalue(), metadata, encoder_profile)
+    return image
+
+
+@contextmanager
+def timed(timings: Dict[str, List[float]], stage: str) -> Iterator[None]:
+    """
+    Add the time taken by the body of a with statement to a stage's timings
+    :param timings:
+    :param stage:
+    :return:
+    """
+    start = perf_counter()
+    yield
+    timings[stage].append(perf_counter() - start)
+
+
+def time_operation(operation: str, image_file: str, settings: BenchmarkSettings) -> Result:
+    """
+    Time one of Watermarker's public operations end to end
+    :param operation: watermark_image, mark_in_place or copy_with_watermark
+    :param image_file:
+    :param settings:
+    :return: Median time, with peak memory
+    """
+    watermarker = Watermarker(settings['watermark_file'])
+    watermarker.set_encoder_profile(settings['encoder_profile'])
+    extension = ENCODER_PROFILES[settings['encoder_profile']]['extension']
+    output_file = str(Path(image_file).with_name('output' + extension))
+    times = []
+    for _ in range(settings['repeat']):
+        watermarker.tile_cache.clear()
+        if operation == 'mark_in_place':
+            shutil.copyfile(image_file, output_file)
+
+        start = perf_counter()
+        if operation == 'watermark_image':
+            watermarker.watermark_image(Image.open(image_file))
+        elif operation == 'mark_in_place':
+            watermarker.mark_in_place(output_file)
+        else:
+            watermarker.copy_with_watermark(image_file, output_file, settings['max_edge'] or None)
+        times.append(perf_counter() - start)
+
+    if Path(output_file).exists():
+        Path(output_file).unlink()
+    return {'seconds': median(times), 'peak_rss_mb': peak_rss_mb()}
+
+
+def print_result(name: str, result: Result) -> None:
+    """
+    Print a one-case summary
+    :param name:
+    :param result:
+    :return:
+    """
+    stages = ', '.join(f'{stage} {seconds * 1000:.0f}' for stage, seconds in result['stages'].items())
+    print(f'  {name} ({result["width"]}x{result["height"]}) stages, ms: {stages}; '
+          f'peak {result["peak_rss_mb"]:.0f} MB')
+    for operation, timing in result['operations'].items():
+        print(f'  {name} {operation}: {timing["seconds"] * 1000:.0f} ms, peak {timing["peak_rss_mb"]:.0f} MB')
+
+
+def flatten_result(result: Result) -> Dict[str, float]:
+    """
+    List the measurements of a case as metric name: value
+    :param result:
+    :return:
+    """
+    metrics = {f'{stage} s': seconds for stage, seconds in result['stages'].items()}
+    metrics['stages peak MB'] = result['peak_rss_mb']
+    for operation, timing in result['operations'].items():
+        metrics[f'{operation} s'] = timing['seconds']
+        metrics[f'{operation} peak MB'] = timing['peak_rss_mb']
+    return metrics
+
+
+def compare_results(previous: Dict[str, Result], current: Dict[str, Result], threshold: float) -> int:
+    """
+    Print how each measurement changed since an earlier run, flagging regressions
+    :param previous:
+    :param current:
+    :param threshold: Percentage increase counted as a regression
+    :return: Number of regressions
+    """
+    regressions = 0
+    print(f'{"case":<24} {"metric":<26} {"before":>10} {"after":>10} {"change":>8}')
+    for name in sorted(set(previous) & set(current)):
+        before_metrics = flatten_result(previous[name])
+        for metric, after in flatten_result(current[name]).items():
+            before = before_metrics.get(metric)
+            if not before:
+                continue
+            change = (after - before) / before * 100
+            noise = metric.endswith(' s') and abs(after - before) < MIN_TIME_CHANGE
+            regressed = change > threshold and not noise
+            regressions += regressed
+            print(f'{name:<24} {metric:<26} {before:>10.3f} {after:>10.3f} {change:>+7.1f}%'
+                  f'{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+if __name__ == '__main__':
+    run_cli()
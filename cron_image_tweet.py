@@ -18,7 +18,7 @@ import twitter
 from dateutil.parser import parse
 from typing_extensions import TypedDict
 
-from phetch_tools import init_flickr_client, load_config
+from phetch_tools import PhotoCatalog, init_flickr_client, load_config
 
 ScheduledId = TypedDict('ScheduledId', {'photo_id': str, 'date_str': str})
 SimpleTweet = TypedDict('SimpleTweet', {'text': str, 'media': str})
@@ -47,6 +47,7 @@ def parse_cli_args() -> argparse.Namespace:
     group.add_argument('--source-flickr-file-list', help='File containing list of Flickr photo dates/ids')
     parser.add_argument('--dry-run', help="Prepare the tweet but don't send it", action='store_true')
     parser.add_argument('--for-date', help="Generate a tweet for a specific day (YYYYmmdd format)")
+    parser.add_argument('--catalog', help='SQLite photo catalog to keep fetched Flickr photo info in')
     args = parser.parse_args()
 
     if args.for_date and not re.match(r'^\d{8}$', args.for_date):
@@ -125,7 +126,8 @@ def get_due_item_from_schedule(schedule: List[ScheduledId], for_date: str = None
     return today_items.pop() if len(today_items) > 0 else None
 
 
-def build_tweet_by_flickr_photo_id(photo_id: str, hashtag: str = '') -> SimpleTweet:
+def build_tweet_by_flickr_photo_id(photo_id: str, hashtag: str = '',
+                                   catalog: Optional[PhotoCatalog] = None) -> SimpleTweet:
     """
        - get k-size image URI -
          - https://www.flickr.com/services/api/flickr.photos.getSizes.html
@@ -135,19 +137,23 @@ def build_tweet_by_flickr_photo_id(photo_id: str, hashtag: str = '') -> SimpleTw
 
     :param hashtag:
     :param photo_id:
+    :param catalog: Catalog to reuse previously fetched photo info from, and to store newly fetched info in
     :return:
     """
     flickr = init_flickr_client('./config.yml')
 
-    url = get_photo_url(flickr, photo_id)
+    # Always fetched, so that its last update time can show whether the catalog's other responses are still current
+    info = call_photo_api(flickr, 'getInfo', photo_id)
+    if catalog:
+        catalog.update_photo_info(photo_id, info)
 
-    info = flickr.photos.getInfo(photo_id=photo_id)
+    url = get_photo_url(flickr, photo_id, catalog)
     when = info['photo']['dates']['taken']
     title = read_content(info['photo']['title'])
     when_date = parse(when)
     friendly_date = pendulum.instance(when_date).format('Do MMMM Y')  # type: ignore
 
-    locale = get_photo_location_parts(flickr, photo_id)
+    locale = get_photo_location_parts(flickr, photo_id, catalog)
 
     tagged_place = get_tagged_place(info)
     if tagged_place:
@@ -157,7 +163,7 @@ def build_tweet_by_flickr_photo_id(photo_id: str, hashtag: str = '') -> SimpleTw
     if len(locale_string) > 0:
         locale_string = '\n' + locale_string
 
-    properties_string = get_photo_properties_string(flickr, photo_id)
+    properties_string = get_photo_properties_string(flickr, photo_id, catalog)
     if len(properties_string) > 0:
         properties_string = '\n' + properties_string
 
@@ -171,6 +177,28 @@ def build_tweet_by_flickr_photo_id(photo_id: str, hashtag: str = '') -> SimpleTw
     }
 
 
+def call_photo_api(flickr: flickrapi.FlickrAPI, method: str, photo_id: str,
+                   catalog: Optional[PhotoCatalog] = None) -> Dict:
+    """
+    Call a flickr.photos API method for a photo, eg 'geo.getLocation', using the catalog's copy of the response if any.
+    Copies are kept until PhotoCatalog.update_photo_info finds that the photo has changed.
+    :param flickr:
+    :param method: API method below flickr.photos
+    :param photo_id:
+    :param catalog:
+    :return:
+    """
+    response = catalog.get_photo_info(photo_id, method) if catalog else None
+    if response is None:
+        api_method = flickr.photos
+        for name in method.split('.'):
+            api_method = getattr(api_method, name)
+        response = api_method(photo_id=photo_id)
+        if catalog:
+            catalog.put_photo_info(photo_id, method, response)
+    return response
+
+
 def get_tagged_place(info) -> Optional[str]:
     """
     Find a geo:place tag from image's flickr info
@@ -196,16 +224,17 @@ def first(values) -> Any:
     return values[0] if len(values) > 0 else None
 
 
-def get_photo_properties_string(flickr, photo_id) -> str:
+def get_photo_properties_string(flickr, photo_id, catalog: Optional[PhotoCatalog] = None) -> str:
     """
     Get a location string for the given photo from the Flickr API
     :param flickr:
     :param photo_id:
+    :param catalog:
     :return:
     """
     properties_string = ''
     try:
-        exif_data = flickr.photos.getExif(photo_id=photo_id)
+        exif_data = call_photo_api(flickr, 'getExif', photo_id, catalog)
         properties = exif_data['photo']['exif']
         # print(properties)
         model = first([read_content(p['raw']) for p in properties if p['tag'] == 'Model'])
@@ -228,14 +257,15 @@ def get_photo_properties_string(flickr, photo_id) -> str:
     return properties_string
 
 
-def get_photo_location_string(flickr, photo_id) -> str:
+def get_photo_location_string(flickr, photo_id, catalog: Optional[PhotoCatalog] = None) -> str:
     """
     Get a location string for the given photo from the Flickr API
     :param flickr:
     :param photo_id:
+    :param catalog:
     :return:
     """
-    locale = get_photo_location_parts(flickr, photo_id)
+    locale = get_photo_location_parts(flickr, photo_id, catalog)
     return join_locale(locale)
 
 
@@ -253,19 +283,20 @@ def join_locale(locale: List[str]) -> str:
     return locale_string
 
 
-def get_photo_location_parts(flickr, photo_id) -> List[str]:
+def get_photo_location_parts(flickr, photo_id, catalog: Optional[PhotoCatalog] = None) -> List[str]:
     """
     Get a List containing whatever location data is available for an image via the flickr API
     Args:
         flickr:
         photo_id:
+        catalog:
 
     Returns:
 
     """
     locale = []
     try:
-        gps_data = flickr.photos.geo.getLocation(photo_id=photo_id)
+        gps_data = call_photo_api(flickr, 'geo.getLocation', photo_id, catalog)
         location = gps_data['photo']['location']
         neighbourhood = read_content(location['neighbourhood'])
         locality = read_content(location['locality'])
@@ -284,14 +315,15 @@ def read_content(element: Optional[Dict[str, str]]) -> str:
     return element['_content'] if element and element['_content'] else ''
 
 
-def get_photo_url(flickr: flickrapi.FlickrAPI, photo_id: str) -> str:
+def get_photo_url(flickr: flickrapi.FlickrAPI, photo_id: str, catalog: Optional[PhotoCatalog] = None) -> str:
     """
     Get the source URL for an image ID from flickr, ideally the 'k' size
     :param flickr:
     :param photo_id:
+    :param catalog:
     :return:
     """
-    size_response = flickr.photos.getSizes(photo_id=photo_id)
+    size_response = call_photo_api(flickr, 'getSizes', photo_id, catalog)
     k_urls = [size['source'] for size in size_response['sizes']['size'] if size['label'] == 'Large 2048']
     o_urls = [size['source'] for size in size_response['sizes']['size'] if size['label'] == 'Original']
     url = k_urls[0] if len(k_urls) > 0 else o_urls[0]
@@ -335,12 +367,13 @@ def run_cli() -> None:
     else:
         raise NotImplementedError("--source mechanism selected hasn't been coded yet!")
 
-    post_tweet_from_schedule(schedule, DEFAULT_HASHTAG, dry_run, args.for_date)
+    catalog = PhotoCatalog(args.catalog) if args.catalog else None
+    post_tweet_from_schedule(schedule, DEFAULT_HASHTAG, dry_run, args.for_date, catalog)
 
 
 def post_tweet_from_schedule(
         schedule: List[ScheduledId], hashtag: str = '', dry_run: bool = False,
-        for_date: str = None):
+        for_date: str = None, catalog: Optional[PhotoCatalog] = None):
     """
     Check for a due tweet, build and post it
 
@@ -348,12 +381,13 @@ def post_tweet_from_schedule(
     :param schedule:
     :param dry_run: If true, just report on what the tweet would contain
     :param for_date: Generate tweet for this date; default today
+    :param catalog: Photo catalog to cache Flickr photo info in, if any
     :return:
     """
     assert_schedule_unique(schedule)
     due_photo = get_due_item_from_schedule(schedule, for_date)
     if due_photo:
-        tweet: SimpleTweet = build_tweet_by_flickr_photo_id(due_photo['photo_id'], hashtag)
+        tweet: SimpleTweet = build_tweet_by_flickr_photo_id(due_photo['photo_id'], hashtag, catalog)
         twitter_api = init_twitter_client('./config.yml')
         if dry_run:
             print('Dry run: generated ', tweet)
@@ -382,11 +416,13 @@ def lambda_handler(event: Any, context: Any):
     source_file = getenv('POTD_SCHEDULE_FILE')
     dry_run = bool(getenv('POTD_DRY_RUN'))
     hashtag = getenv('POTD_HASHTAG', '')
+    catalog_file = getenv('POTD_CATALOG')
     if source_file is None:
         print('POTD_SCHEDULE_FILE environmental variable must be defined')
         sys.exit(1)
     schedule = scan_file_for_coded_filenames(Path(source_file))
-    post_tweet_from_schedule(schedule, hashtag, dry_run)
+    catalog = PhotoCatalog(catalog_file) if catalog_file else None
+    post_tweet_from_schedule(schedule, hashtag, dry_run, catalog=catalog)
 
 
 if __name__ == '__main__':
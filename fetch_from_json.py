@@ -4,13 +4,15 @@ Fetch list of images according to remote JSON file
 """
 
 import argparse
-import json
 import re
+from itertools import islice
 from pathlib import Path
+from typing import Iterable
 
 import requests
 
 from phetch_tools import PhotoListFetcher
+from phetch_tools.photo_list import iter_photo_list
 
 
 def parse_cli_args() -> argparse.Namespace:
@@ -23,9 +25,10 @@ def parse_cli_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description='Download list of images specified in a JSON file',
     )
-    parser.add_argument('json', help='Path or URI of JSON file')
+    parser.add_argument('json', help='Path or URI of JSON or JSON lines file')
     parser.add_argument('output', help='Directory to save files to')
     parser.add_argument('--limit', required=False, help='Max images to download', type=int, default=0)
+    parser.add_argument('--jobs', help='Number of images to download at once', type=int, default=1)
     args = parser.parse_args()
     return args
 
@@ -37,19 +40,29 @@ def run_cli() -> None:
     """
     args = parse_cli_args()
     if re.match(r"^http(s?)://", args.json):
-        # Assume URL
-        content = requests.get(args.json).content
-        photos = json.loads(content)
+        # Assume URL; stream it, so that downloads start with the first photos listed
+        with requests.get(args.json, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.encoding = 'UTF-8'
+            fetch_photo_list(args, response.iter_lines(decode_unicode=True))
     else:
         # Assume file
-        with open(args.json) as content_fp:
-            photos = json.load(content_fp)
+        with open(args.json, encoding='UTF-8') as content_fp:
+            fetch_photo_list(args, content_fp)
 
+
+def fetch_photo_list(args: argparse.Namespace, lines: Iterable[str]) -> None:
+    """
+    Download the photos in a photo list, given as lines of JSON lines or plain JSON, as they're read
+    :param args:
+    :param lines:
+    :return:
+    """
     downloader = PhotoListFetcher()
+    downloader.set_jobs(args.jobs)
     Path(args.output).mkdir(exist_ok=True, parents=True)
-    if args.limit:
-        photos = photos[:args.limit]
-    downloader.fetch_photos(photos, args.output)
+    photos = iter_photo_list(lines)
+    downloader.fetch_photos(islice(photos, args.limit) if args.limit else photos, args.output)
 
 
 if __name__ == '__main__':
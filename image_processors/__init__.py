@@ -1,3 +1,4 @@
+from .watermark_pool import WatermarkPool
 from .watermarker import Watermarker
 
-__all__ = ['Watermarker']
+__all__ = ['Watermarker', 'WatermarkPool']
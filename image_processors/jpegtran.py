@@ -0,0 +1,62 @@
+"""
+Lossless JPEG operations via the jpegtran command-line tool (libjpeg-turbo 2.1+ or IJG libjpeg 9+ for -drop)
+"""
+import shutil
+import subprocess
+from typing import Optional, Tuple
+
+
+def find_jpegtran() -> Optional[str]:
+    """
+    Locate the jpegtran executable, if installed
+
+    :return:
+    """
+    return shutil.which('jpegtran')
+
+
+def crop(jpegtran: str, input_file: str, box: Tuple[int, int, int, int], output_file: str) -> None:
+    """
+    Losslessly crop a JPEG, discarding metadata. Left and top should be on MCU boundaries.
+
+    :param jpegtran: Path to jpegtran
+    :param input_file:
+    :param box: left, top, right, bottom
+    :param output_file:
+    :return:
+    """
+    left, top, right, bottom = box
+    run_jpegtran(
+        [jpegtran, '-copy', 'none', '-crop', f'{right - left}x{bottom - top}+{left}+{top}',
+         '-outfile', output_file, input_file]
+    )
+
+
+def drop(jpegtran: str, input_file: str, insert_file: str, position: Tuple[int, int], output_file: str) -> None:
+    """
+    Losslessly replace part of a JPEG with another JPEG, keeping all metadata of the original.
+    Position should be on MCU boundaries, and both images must have the same components and sampling.
+
+    :param jpegtran: Path to jpegtran
+    :param input_file:
+    :param insert_file:
+    :param position: left, top
+    :param output_file:
+    :return:
+    """
+    left, top = position
+    run_jpegtran(
+        [jpegtran, '-copy', 'all', '-drop', f'+{left}+{top}', insert_file, '-outfile', output_file, input_file]
+    )
+
+
+def run_jpegtran(command: list) -> None:
+    """
+    Run a jpegtran command, raising an OSError with its message on failure
+
+    :param command:
+    :return:
+    """
+    result = subprocess.run(command, capture_output=True, check=False)
+    if result.returncode != 0:
+        raise OSError(f'jpegtran failed: {result.stderr.decode(errors="replace").strip()}')
@@ -0,0 +1,148 @@
+"""
+Class file for WatermarkPool
+"""
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count
+from typing import Any, Callable, List, Optional
+
+from .watermarker import (DEFAULT_ENCODER_PROFILE, EncodeStats, Rendition,
+                          Watermarker)
+
+# Each worker process loads the watermark once, in init_worker, and reuses it for every image
+worker_watermarker: Optional[Watermarker] = None  # pylint: disable=invalid-name
+
+
+def init_worker(watermark_file: str, opacity: Optional[float], lossless: bool = False,
+                encoder_profile: str = DEFAULT_ENCODER_PROFILE) -> None:
+    """
+    Set up the Watermarker for a worker process
+    :param watermark_file:
+    :param opacity:
+    :param lossless:
+    :param encoder_profile:
+    :return:
+    """
+    global worker_watermarker  # pylint: disable=global-statement
+    worker_watermarker = Watermarker(watermark_file)
+    if opacity:
+        worker_watermarker.set_watermark_opacity(opacity)
+    if lossless:
+        worker_watermarker.set_lossless(True)
+    worker_watermarker.set_encoder_profile(encoder_profile)
+
+
+def get_worker_watermarker() -> Watermarker:
+    """
+    This worker's Watermarker, with its encode stats reset so that each task reports only its own
+    :return:
+    """
+    if worker_watermarker is None:
+        raise RuntimeError('Worker watermarker was not initialised')
+    worker_watermarker.encode_stats = EncodeStats()
+    return worker_watermarker
+
+
+def mark_in_place(image_file_path: str) -> EncodeStats:
+    """
+    Watermark a file in place using this worker's Watermarker
+    :param image_file_path:
+    :return:
+    """
+    watermarker = get_worker_watermarker()
+    watermarker.mark_in_place(image_file_path)
+    return watermarker.encode_stats
+
+
+def copy_with_watermark_renditions(input_file: str, renditions: List[Rendition]) -> EncodeStats:
+    """
+    Save watermarked copies of a file using this worker's Watermarker
+    :param input_file:
+    :param renditions:
+    :return:
+    """
+    watermarker = get_worker_watermarker()
+    watermarker.copy_with_watermark_renditions(input_file, renditions)
+    return watermarker.encode_stats
+
+
+class WatermarkPool:
+    """
+    Watermark files on a pool of worker processes, so that CPU-bound watermarking runs alongside other work
+    and on every core. Submitting blocks once max_pending files are waiting, to keep memory bounded.
+    """
+    executor: ProcessPoolExecutor
+    error: Optional[BaseException]
+    encode_stats: EncodeStats  # totals from all finished files
+
+    def __init__(self, watermark_file: str, opacity: Optional[float] = None,  # pylint: disable=too-many-arguments
+                 workers: Optional[int] = None, max_pending: Optional[int] = None, *, lossless: bool = False,
+                 encoder_profile: str = DEFAULT_ENCODER_PROFILE) -> None:
+        workers = workers or cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                            initargs=(watermark_file, opacity, lossless, encoder_profile))
+        self.pending = threading.BoundedSemaphore(max_pending or workers * 2)
+        self.error = None
+        self.encode_stats = EncodeStats()
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self) -> 'WatermarkPool':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        # Don't let a failed watermark replace the error already on its way out
+        self.close(raise_error=exc_type is None)
+
+    def submit(self, image_file_path: str) -> None:
+        """
+        Queue a file to be watermarked in place; usable as a PhotoListFetcher post-download callback
+        :param image_file_path:
+        :return:
+        """
+        self.submit_task(mark_in_place, image_file_path)
+
+    def submit_renditions(self, input_file: str, renditions: List[Rendition]) -> None:
+        """
+        Queue a file to have watermarked copies made, as Watermarker.copy_with_watermark_renditions
+        :param input_file:
+        :param renditions:
+        :return:
+        """
+        self.submit_task(copy_with_watermark_renditions, input_file, renditions)
+
+    def submit_task(self, task: Callable[..., EncodeStats], *args: Any) -> None:
+        """
+        Queue a task for a worker, waiting for a free slot if too many are pending
+        :param task:
+        :param args:
+        :return:
+        """
+        if self.error:
+            raise self.error
+        self.pending.acquire()  # pylint: disable=consider-using-with
+        future = self.executor.submit(task, *args)
+        future.add_done_callback(self.task_done)
+
+    def task_done(self, future: Future) -> None:
+        """
+        Free a queue slot when a file is finished, adding up its encode stats or keeping the first error to report
+        :param future:
+        :return:
+        """
+        self.pending.release()
+        if future.exception():
+            if not self.error:
+                self.error = future.exception()
+            return
+        with self.stats_lock:
+            self.encode_stats.merge(future.result())
+
+    def close(self, raise_error: bool = True) -> None:
+        """
+        Wait for all queued files to be watermarked, raising the first error if any failed
+        :param raise_error: False to only shut down, eg while another error is being handled
+        :return:
+        """
+        self.executor.shutdown(wait=True)
+        if self.error and raise_error:
+            raise self.error
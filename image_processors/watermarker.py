@@ -1,57 +1,157 @@
 """
 Class file for Watermarker
 """
-from typing import Optional, Tuple
+import shutil
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 
 import pyexiv2
-from PIL import Image, ImageStat
+from PIL import Image, ImageStat, JpegImagePlugin
 from PIL.ImageFile import ImageFile
+from typing_extensions import TypedDict
 
+from . import jpegtran
 
-def standard_save(image: Image, image_file_path: str):
+ImageMetadata = TypedDict('ImageMetadata', {'iptc': dict, 'xmp': str})
+Rendition = Tuple[Optional[int], str]  # max_edge, output file
+EncoderProfile = TypedDict('EncoderProfile', {'format': str, 'extension': str, 'options': Dict[str, Any]})
+
+# Named output encodings; options are passed through to PIL's save
+ENCODER_PROFILES: Dict[str, EncoderProfile] = {
+    'archive': {'format': 'JPEG', 'extension': '.jpg', 'options': {'quality': 95, 'subsampling': '4:4:4'}},
+    'screensaver': {'format': 'JPEG', 'extension': '.jpg',
+                    'options': {'quality': 88, 'subsampling': '4:2:0', 'optimize': True}},
+    'web': {'format': 'JPEG', 'extension': '.jpg',
+            'options': {'quality': 82, 'subsampling': '4:2:0', 'optimize': True, 'progressive': True}},
+    'webp': {'format': 'WEBP', 'extension': '.webp', 'options': {'quality': 82, 'method': 4}},
+}
+DEFAULT_ENCODER_PROFILE = 'archive'
+
+# Per-channel lookup tables for Image.point on RGBA images, which take 256 entries per band
+IDENTITY_LUT = list(range(256))
+INVERT_LUT = [255 - i for i in range(256)]
+BRIGHTNESS_SAMPLE_EDGE = 256  # long edge of the sample grid used to estimate corner brightness
+DRAFT_REDUCING_GAP = 2  # as Image.thumbnail: JPEG draft decodes stop at this multiple of the target size, or above
+
+
+def standard_save(image: Image, image_file: Union[str, BinaryIO], profile: str = DEFAULT_ENCODER_PROFILE):
     """
     PIL throws a lot of data away on save by default. Preserve it instead!
 
     :param image:
-    :param image_file_path:
+    :param image_file: path, or file object to write to
+    :param profile: Name of an ENCODER_PROFILES entry
     :return:
     """
+    encoder_profile = ENCODER_PROFILES[profile]
     image.save(
-        image_file_path,
-        quality=95,
+        image_file,
+        format=encoder_profile['format'],
         icc_profile=image.info['icc_profile'] if 'icc_profile' in image.info else None,
         exif=image.info["exif"],
-        subsampling='4:4:4'
+        **encoder_profile['options']
     )
 
 
-def write_iptc(image_file_path: str, iptc: dict):
+def read_metadata(image_data: bytes) -> ImageMetadata:
     """
-    Write iptc data to file
+    Read the metadata that PIL doesn't carry over on save (IPTC, XMP) from an encoded image
 
-    :param image_file_path:
-    :param iptc:
+    :param image_data:
     :return:
     """
-    exiv_image = pyexiv2.Image(image_file_path)
-    exiv_image.modify_iptc(iptc)
+    exiv_image = pyexiv2.ImageData(image_data)
+    metadata: ImageMetadata = {'iptc': exiv_image.read_iptc(), 'xmp': exiv_image.read_raw_xmp()}
     exiv_image.close()
+    return metadata
+
+
+def encode_with_metadata(image: Image, metadata: ImageMetadata, profile: str = DEFAULT_ENCODER_PROFILE) -> bytes:
+    """
+    Encode an image with standard_save, then add IPTC and XMP metadata to the encoded data, all in memory.
+    WebP has no place for IPTC, so only XMP is carried over to it.
+
+    :param image:
+    :param metadata:
+    :param profile: Name of an ENCODER_PROFILES entry
+    :return:
+    """
+    buffer = BytesIO()
+    standard_save(image, buffer, profile)
+    return add_metadata(buffer.getvalue(), metadata, profile)
 
 
-def read_iptc(image_file_path: str) -> dict:
+def add_metadata(image_data: bytes, metadata: ImageMetadata, profile: str = DEFAULT_ENCODER_PROFILE) -> bytes:
     """
-    Read iptc data from file
+    Add IPTC and XMP metadata to encoded image data
 
-    :param image_file_path:
+    :param image_data:
+    :param metadata:
+    :param profile: Name of the ENCODER_PROFILES entry the data was encoded with
     :return:
     """
-    exiv_image = pyexiv2.Image(image_file_path)
-    iptc = exiv_image.read_iptc()
+    has_iptc = bool(metadata['iptc']) and ENCODER_PROFILES[profile]['format'] == 'JPEG'
+    if not has_iptc and not metadata['xmp']:
+        return image_data
+
+    exiv_image = pyexiv2.ImageData(image_data)
+    if has_iptc:
+        exiv_image.modify_iptc(metadata['iptc'])
+    if metadata['xmp']:
+        exiv_image.modify_raw_xmp(metadata['xmp'])
+    image_data = exiv_image.get_bytes()
     exiv_image.close()
-    return iptc
+    return image_data
 
 
-class Watermarker:
+class EncodeStats:
+    """
+    Running totals of files, bytes written and time spent encoding, per encoder profile, with lossless
+    watermarking counted as 'lossless'
+    """
+    totals: Dict[str, List[float]]  # profile: [files, bytes, seconds]
+
+    def __init__(self) -> None:
+        self.totals = {}
+
+    def add(self, profile: str, byte_count: int, seconds: float) -> None:
+        """
+        Record one encoded file
+        :param profile:
+        :param byte_count:
+        :param seconds:
+        :return:
+        """
+        files, total_bytes, total_seconds = self.totals.get(profile, [0, 0, 0.0])
+        self.totals[profile] = [files + 1, total_bytes + byte_count, total_seconds + seconds]
+
+    def merge(self, other: 'EncodeStats') -> None:
+        """
+        Add another set of totals, eg from a worker process, to these
+        :param other:
+        :return:
+        """
+        for profile, (files, total_bytes, total_seconds) in other.totals.items():
+            current = self.totals.get(profile, [0, 0, 0.0])
+            self.totals[profile] = [current[0] + files, current[1] + total_bytes, current[2] + total_seconds]
+
+    def report(self) -> str:
+        """
+        Summarise the totals, one line per profile
+        :return:
+        """
+        return '\n'.join(
+            f'{profile}: {int(files)} files, {total_bytes / 1024 / 1024:.1f} MB written, '
+            f'{total_seconds:.1f}s encoding ({total_seconds / files * 1000:.0f} ms/file)'
+            for profile, (files, total_bytes, total_seconds) in sorted(self.totals.items())
+        )
+
+
+class Watermarker:  # pylint: disable=too-many-instance-attributes
     """
     Tool to add transparent watermark to images
     """
@@ -59,6 +159,11 @@ class Watermarker:
     watermark: ImageFile
     watermark_opacity: float
     watermark_brightness_threshold: int  # max target area brightness to use the "light" watermark
+    tile_cache: 'OrderedDict[Tuple[int, int, bool, float], Image]'  # prepared watermarks, least recently used first
+    tile_cache_size: int = 16
+    encoder_profile: str  # ENCODER_PROFILES entry used to save watermarked images
+    encode_stats: EncodeStats
+    jpegtran_path: Optional[str] = None  # set to watermark JPEGs in place losslessly outside the watermark
 
     def __init__(self, watermark_file: str) -> None:
         super().__init__()
@@ -68,6 +173,9 @@ class Watermarker:
         self.long_edge_border_ratio = 0.01  # default
         self.watermark_opacity = 0.5  # default
         self.watermark_brightness_threshold = 180  # default
+        self.encoder_profile = DEFAULT_ENCODER_PROFILE  # default
+        self.encode_stats = EncodeStats()
+        self.tile_cache = OrderedDict()
 
     def __del__(self):
         self.watermark.close()
@@ -79,6 +187,7 @@ class Watermarker:
         :return:
         """
         self.long_edge_watermark_ratio = long_edge_ratio
+        self.tile_cache.clear()
 
     def set_border_size(self, border_ratio: float):
         """
@@ -87,6 +196,7 @@ class Watermarker:
         :return:
         """
         self.long_edge_border_ratio = border_ratio
+        self.tile_cache.clear()
 
     def set_watermark_opacity(self, opacity: float):
         """
@@ -95,6 +205,30 @@ class Watermarker:
         :return:
         """
         self.watermark_opacity = float(opacity)
+        self.tile_cache.clear()
+
+    def set_encoder_profile(self, profile: str):
+        """
+        Set the ENCODER_PROFILES entry used to save watermarked images
+        :param profile:
+        :return:
+        """
+        if profile not in ENCODER_PROFILES:
+            raise ValueError(f'Unknown encoder profile {profile}; expected one of {", ".join(ENCODER_PROFILES)}')
+        self.encoder_profile = profile
+
+    def set_lossless(self, lossless: bool) -> bool:
+        """
+        Set whether mark_in_place should re-encode only the JPEG blocks under the watermark, leaving the rest
+        of the file bit-for-bit unchanged. Needs jpegtran with -drop support. The encoder profile does not apply
+        to images watermarked this way, as the corner keeps the image's own quantization tables and sampling.
+        :param lossless:
+        :return: Whether lossless mode is available and enabled
+        """
+        self.jpegtran_path = jpegtran.find_jpegtran() if lossless else None
+        if lossless and not self.jpegtran_path:
+            print('jpegtran not found; watermarked images will be fully re-encoded')
+        return self.jpegtran_path is not None
 
     def mark_in_place(self, image_file_path: str) -> None:
         """
@@ -103,11 +237,94 @@ class Watermarker:
         :param image_file_path:
         :return:
         """
-        image: ImageFile = Image.open(image_file_path)
-        iptc = read_iptc(image_file_path)
+        if ENCODER_PROFILES[self.encoder_profile]['format'] != 'JPEG':
+            raise ValueError(f'Encoder profile {self.encoder_profile} would change the format of {image_file_path}')
+        if self.jpegtran_path:
+            try:
+                self.mark_in_place_lossless(image_file_path, self.jpegtran_path)
+                return
+            except (OSError, ValueError) as err:
+                print(f'Lossless watermark of {image_file_path} failed ({err}), re-encoding instead')
+
+        # One read and one write: metadata is carried across to the new encoding in memory
+        image_data = Path(image_file_path).read_bytes()
+        metadata = read_metadata(image_data)
+        image: ImageFile = Image.open(BytesIO(image_data))
         image = self.watermark_image(image)
-        standard_save(image, image_file_path)
-        write_iptc(image_file_path, iptc)
+        Path(image_file_path).write_bytes(self.encode(image, metadata))
+
+    def mark_in_place_lossless(self, image_file_path: str, jpegtran_path: str) -> None:
+        """
+        Apply the loaded watermark to a JPEG, re-encoding only the MCU blocks under the watermark with the image's
+        own quantization tables and sampling. All other data, including metadata, is copied through unchanged.
+        The encoder profile is not used; encode_stats counts the file under 'lossless'.
+
+        :param image_file_path:
+        :param jpegtran_path:
+        :return:
+        """
+        start = perf_counter()
+        image = Image.open(image_file_path)
+        if not isinstance(image, JpegImagePlugin.JpegImageFile) or image.mode not in ('RGB', 'L'):
+            raise ValueError(f'{image.format} {image.mode} image is not supported')
+        corner_position, watermark_position, watermark_size = self.calculate_lossless_corner(image)
+        image.close()
+
+        with TemporaryDirectory() as work_dir:
+            corner_file = str(Path(work_dir) / 'corner.jpg')
+            marked_file = str(Path(work_dir) / 'marked.jpg')
+            output_file = str(Path(work_dir) / 'output.jpg')
+            jpegtran.crop(jpegtran_path, image_file_path, corner_position + image.size, corner_file)
+            self.watermark_jpeg_corner(corner_file, marked_file, watermark_position, watermark_size)
+            jpegtran.drop(jpegtran_path, image_file_path, marked_file, corner_position, output_file)
+            with Image.open(output_file) as output:
+                if output.size != image.size:
+                    raise ValueError(f'jpegtran produced a {output.size} image from {image.size}')
+            byte_count = Path(output_file).stat().st_size
+            shutil.move(output_file, image_file_path)
+        self.encode_stats.add('lossless', byte_count, perf_counter() - start)
+
+    def calculate_lossless_corner(
+            self, image: JpegImagePlugin.JpegImageFile
+    ) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]]:
+        """
+        Find the bottom right corner of a JPEG holding the watermark, with its top left aligned to whole MCUs
+        so that it can be cut out and dropped back in losslessly
+
+        :param image:
+        :return: Corner left, top; watermark left, top within the corner; watermark width, height
+        """
+        mcu_width = 8 * max(layer[1] for layer in image.layer)
+        mcu_height = 8 * max(layer[2] for layer in image.layer)
+        watermark_width, watermark_height, border_w, border_h = self.calculate_watermark_dimensions(image)
+        watermark_left = image.width - watermark_width - border_w
+        watermark_top = image.height - watermark_height - border_h
+        return (
+            (watermark_left - watermark_left % mcu_width, watermark_top - watermark_top % mcu_height),
+            (watermark_left % mcu_width, watermark_top % mcu_height),
+            (watermark_width, watermark_height),
+        )
+
+    def watermark_jpeg_corner(self, corner_file: str, output_file: str, watermark_position: Tuple[int, int],
+                              watermark_size: Tuple[int, int]) -> None:
+        """
+        Watermark a corner cut from a JPEG, saving it with the same quantization tables and sampling so that it
+        can be dropped back into the original
+
+        :param corner_file:
+        :param output_file:
+        :param watermark_position: left, top within the corner
+        :param watermark_size: width, height
+        :return:
+        """
+        corner = Image.open(corner_file)
+        if not isinstance(corner, JpegImagePlugin.JpegImageFile):
+            raise ValueError(f'jpegtran produced a {corner.format} corner')
+        area_is_bright = self.watermark_area_is_bright(corner, *watermark_position)
+        local_watermark = self.prepare_pastable_watermark(*watermark_size, dark=area_is_bright)
+        marked = self.apply_prepared_watermark(corner.copy(), local_watermark, watermark_position)
+        marked.convert(corner.mode).save(output_file, qtables=corner.quantization,
+                                         subsampling=JpegImagePlugin.get_sampling(corner))
 
     def copy_with_watermark(self, input_file: str, output_file: str, max_edge: Optional[int] = None) -> None:
         """
@@ -118,28 +335,70 @@ class Watermarker:
         :param input_file:
         :return:
         """
-        image: ImageFile = Image.open(input_file)
-        iptc = read_iptc(input_file)
-        if max_edge is not None:
-            if image.width > image.height:
-                ratio = max_edge / image.width
-                size = (max_edge, round(image.height * ratio))
-            else:
-                ratio = max_edge / image.height
-                size = (round(image.width * ratio), max_edge)
-            image = image.resize(size, Image.LANCZOS)
+        self.copy_with_watermark_renditions(input_file, [(max_edge, output_file)])
 
-        image = self.watermark_image(image)
-        standard_save(image, output_file)
-        write_iptc(output_file, iptc)
+    def copy_with_watermark_renditions(self, input_file: str, renditions: List[Rendition]) -> None:
+        """
+        Save watermarked copies of the specified image at one or more sizes.
+        The image is decoded and its metadata read once; each size is scaled down from the next larger one.
 
-    def watermark_image(self, image: ImageFile) -> ImageFile:
+        :param input_file:
+        :param renditions: List of (max_edge, output_file); a max_edge of None keeps the original size
+        :return:
+        """
+        image_data = Path(input_file).read_bytes()
+        metadata = read_metadata(image_data)
+        image: ImageFile = Image.open(BytesIO(image_data))
+
+        # Largest first, with None (full size) before any of them
+        ordered = sorted(renditions, key=lambda r: float('-inf') if r[0] is None else -r[0])
+        for index, (max_edge, output_file) in enumerate(ordered):
+            if max_edge is not None:
+                image = self.resize_to_max_edge(image, max_edge)
+            # watermark_image works in place, so while smaller renditions still need the clean image, mark a copy
+            marked = self.watermark_image(image.copy() if index < len(ordered) - 1 else image)
+            Path(output_file).write_bytes(self.encode(marked, metadata))
+
+    def encode(self, image: Image, metadata: ImageMetadata) -> bytes:
+        """
+        Encode a watermarked image with the current encoder profile, keeping count in encode_stats
+        :param image:
+        :param metadata:
+        :return:
         """
-        Add the watermark to the loaded image object
+        start = perf_counter()
+        image_data = encode_with_metadata(image, metadata, self.encoder_profile)
+        self.encode_stats.add(self.encoder_profile, len(image_data), perf_counter() - start)
+        return image_data
 
+    @staticmethod
+    def resize_to_max_edge(image: ImageFile, max_edge: int) -> Image:
+        """
+        Resize an image to fit within a square box.
+        If the image is a JPEG not yet loaded, the decoder's DCT scaling is used to decode it at the smallest
+        size (1/2, 1/4 or 1/8) that's still at least DRAFT_REDUCING_GAP times the target, before the final
+        high-quality resize. Decoding straight to the target would leave the DCT scaling's softer result as the output.
         :param image:
+        :param max_edge:
         :return:
         """
+        if image.width > image.height:
+            ratio = max_edge / image.width
+            size = (max_edge, round(image.height * ratio))
+        else:
+            ratio = max_edge / image.height
+            size = (round(image.width * ratio), max_edge)
+        image.draft(image.mode, (size[0] * DRAFT_REDUCING_GAP, size[1] * DRAFT_REDUCING_GAP))
+        return image.resize(size, Image.LANCZOS)
+
+    def watermark_image(self, image: ImageFile) -> ImageFile:
+        """
+        Add the watermark to the loaded image object. An RGB image is changed in place and returned; pass a copy
+        to keep the original.
+
+        :param image:
+        :return: The watermarked image: the one given if it was RGB, otherwise an RGB conversion of it
+        """
         watermark_width, watermark_height, border_w, border_h = self.calculate_watermark_dimensions(image)
         watermark_left = image.width - watermark_width - border_w
         watermark_top = image.height - watermark_height - border_h
@@ -158,7 +417,11 @@ class Watermarker:
         :param watermark_top:
         :return:
         """
-        target_area = image.crop((watermark_left, watermark_top, image.width - 1, image.height - 1))
+        box = (watermark_left, watermark_top, image.width - 1, image.height - 1)
+        # The mean of an evenly spaced grid of pixels is plenty for a threshold test, and far cheaper than the lot
+        scale = max(1, max(box[2] - box[0], box[3] - box[1]) // BRIGHTNESS_SAMPLE_EDGE)
+        sample_size = (max(1, (box[2] - box[0]) // scale), max(1, (box[3] - box[1]) // scale))
+        target_area = image.resize(sample_size, Image.NEAREST, box=box)
         area_props = ImageStat.Stat(target_area)
         brightness = sum(area_props.mean) / len(area_props.mean)
         area_is_bright = brightness > self.watermark_brightness_threshold
@@ -167,15 +430,22 @@ class Watermarker:
     @staticmethod
     def apply_prepared_watermark(image, local_watermark, watermark_position) -> ImageFile:
         """
-        Apply a prepared watermark to an Image
+        Apply a prepared watermark to an Image.
+        Only the area under the watermark is converted to RGBA for merging; the rest of the image is left alone.
+        An RGB image is pasted into in place and returned, so callers that need the original must pass a copy.
         :param image:
         :param local_watermark:
         :param watermark_position:
-        :return:
+        :return: The watermarked image: the one given if it was RGB, otherwise an RGB conversion of it
         """
-        image = image.convert('RGBA')  # must convert to RGBA to merge with watermark
-        image.paste(local_watermark, watermark_position, local_watermark)
-        image = image.convert('RGB')  # must convert back to RGB to save jpg
+        if image.mode != 'RGB':
+            image = image.convert('RGB')  # must be RGB to save jpg
+        watermark_left, watermark_top = watermark_position
+        box = (watermark_left, watermark_top,
+               watermark_left + local_watermark.width, watermark_top + local_watermark.height)
+        region = image.crop(box).convert('RGBA')  # must convert to RGBA to merge with watermark
+        region.paste(local_watermark, (0, 0), local_watermark)
+        image.paste(region.convert('RGB'), box)
         return image
 
     def calculate_watermark_dimensions(self, image_file: ImageFile) -> Tuple[int, int, int, int]:
@@ -198,29 +468,34 @@ class Watermarker:
 
     def prepare_pastable_watermark(self, watermark_width: int, watermark_height: int, dark: bool = False) -> Image:
         """
-        Scale and apply opacity to watermark as required for use at specified size
+        Scale and apply opacity to watermark as required for use at specified size.
+        Most images come in a handful of sizes, so recently prepared watermarks are kept for reuse.
         :param dark:
         :param watermark_width:
         :param watermark_height:
         :return:
         """
+        key = (watermark_width, watermark_height, dark, self.watermark_opacity)
+        if key in self.tile_cache:
+            self.tile_cache.move_to_end(key)
+            return self.tile_cache[key]
+
         watermark = self.inverse_watermark if dark else self.watermark
         local_watermark = watermark.resize((watermark_width, watermark_height))
-        ch_r, ch_g, ch_b, ch_a = local_watermark.split()
-        ch_a = ch_a.point(lambda i: i * self.watermark_opacity)
-        local_watermark = Image.merge('RGBA', (ch_r, ch_g, ch_b, ch_a))
+        opacity_lut = [round(i * self.watermark_opacity) for i in range(256)]
+        local_watermark = local_watermark.point(IDENTITY_LUT * 3 + opacity_lut)
+
+        self.tile_cache[key] = local_watermark
+        if len(self.tile_cache) > self.tile_cache_size:
+            self.tile_cache.popitem(last=False)
         return local_watermark
 
     @staticmethod
     def invert_watermark(watermark: Image):
         """
-        Invert the watermark's RGB values pixel-by-pixel,
+        Invert the watermark's RGB values, leaving alpha alone,
         ie make a dark watermark out of a light one
         :param watermark:
         :return:
         """
-        ch_r, ch_g, ch_b, ch_a = watermark.split()
-        ch_r = ch_r.point(lambda i: 255 - i)
-        ch_g = ch_g.point(lambda i: 255 - i)
-        ch_b = ch_b.point(lambda i: 255 - i)
-        return Image.merge('RGBA', (ch_r, ch_g, ch_b, ch_a))
+        return watermark.point(INVERT_LUT * 3 + IDENTITY_LUT)
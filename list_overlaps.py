@@ -4,19 +4,24 @@ Fetch photos found in multiple Flickr albums. Run with --help for details
 """
 import argparse
 import csv
+import heapq
 import random
 import re
 import sys
+from collections import deque
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import List
+from typing import Deque, Dict, List, Optional, Tuple
 
 from cron_image_tweet import scan_file_for_coded_filenames
 from phetch import init_flickr_client
-from phetch_tools import FlickrReader
+from phetch_tools import (AlbumScanCache, FlickrReader, PhotoCatalog,
+                          PhotoIndex, PhotoQuery)
+from phetch_tools.album_cache import DEFAULT_CACHE_DIR
 from phetch_tools.types import Photo
 
 PHOTO_URL_PREFIX = "https://www.flickr.com/photos/parsingphase/"
+DEFAULT_MIN_TITLE_GAP = 30  # days
 
 
 def parse_cli_args() -> argparse.Namespace:
@@ -29,30 +34,60 @@ def parse_cli_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description='List photos found in multiple flickr albums',
     )
-    parser.add_argument('album_id', help='Numeric IDs of album from Flickr URL', nargs='+')
+    parser.add_argument('album_id', help='Numeric IDs of album from Flickr URL', nargs='*')
+    parser.add_argument('--query', help='Set expression of album IDs to list photos from instead, '
+                                        'eg "111 & (222 | 333) - 444"; operators &, |, - or AND, OR, NOT')
     parser.add_argument('--from-date', help='Start date in YYYYmmdd format')
+    parser.add_argument('--taken-since', help='Only list photos taken on or after this date, in YYYYmmdd format')
     parser.add_argument('--unique-titles', help='Output only one row per title', action='store_true')
     parser.add_argument('--exclude-from-file', help='Exclude photos already listed in file')
     parser.add_argument('--any-subsequent-album', help='List photos in the first album and ANY subsequent one, '
                                                        'instead of ALL', action='store_true')
     parser.add_argument('--csv', help='Output as CSV', action='store_true')
+    parser.add_argument('--min-title-gap', help='Minimum days between photos with the same title, where possible',
+                        type=int, default=DEFAULT_MIN_TITLE_GAP)
+    parser.add_argument('--album-workers', help='Max albums to scan at once', type=int, default=4)
+    parser.add_argument('--cache-dir', help='Directory for cached album scans', default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache-max-mb', help='Max size of album scan cache, in MB', type=int, default=64)
+    parser.add_argument('--no-cache', help="Rescan all albums and don't update the cache", action='store_true')
+    parser.add_argument('--catalog', help='SQLite photo catalog to record album scans in and answer the query from, '
+                                          'instead of the cache')
+    parser.add_argument('--catalog-only', help="Answer from the catalog as it stands, without checking Flickr for "
+                                               "album changes", action='store_true')
     args = parser.parse_args()
-    if len(args.album_id) < 2:
-        print('Must list at least 2 albums')
+    if args.catalog_only and not args.catalog:
+        print('--catalog-only needs --catalog')
+        parser.print_usage()
+        sys.exit(1)
+    if args.taken_since:
+        args.taken_since = datetime.strptime(args.taken_since, '%Y%m%d').strftime('%Y-%m-%d')
+    if args.query:
+        if args.album_id or args.any_subsequent_album:
+            print('--query replaces album IDs and --any-subsequent-album')
+            parser.print_usage()
+            sys.exit(1)
+        try:
+            args.query = PhotoQuery(args.query)
+        except ValueError as err:
+            print(err)
+            parser.print_usage()
+            sys.exit(1)
+    elif len(args.album_id) < 2:
+        print('Must list at least 2 albums, or a --query')
         parser.print_usage()
         sys.exit(1)
     return args
 
 
-def photos_intersection(list_a: List[Photo], list_b: List[Photo]):
+def build_album_query(album_ids: List[str], any_subsequent_album: bool = False) -> PhotoQuery:
     """
-    Return photos in both lists
-    :param list_a:
-    :param list_b:
+    Build the query for photos in the first album and ALL (or ANY) of the subsequent ones
+    :param album_ids:
+    :param any_subsequent_album:
     :return:
     """
-    filtered = [photo for photo in list_a if photo in list_b]
-    return filtered
+    subsequent = (' | ' if any_subsequent_album else ' & ').join(album_ids[1:])
+    return PhotoQuery(f'{album_ids[0]} & ({subsequent})' if len(album_ids) > 2 else f'{album_ids[0]} & {subsequent}')
 
 
 def unique_titles(photos: List[Photo], defer_remainder=False) -> List[Photo]:
@@ -62,24 +97,68 @@ def unique_titles(photos: List[Photo], defer_remainder=False) -> List[Photo]:
     :param photos:
     :return:
     """
-    seen_titles = []
+    title_counts: Dict[str, int] = {}
     filtered = []
-    deferred = []
+    deferred = []  # (number of earlier photos with the same title, photo)
     for photo in photos:
-        if photo['title'] in seen_titles:
-            deferred.append(photo)
+        title_count = title_counts.get(photo['title'], 0)
+        title_counts[photo['title']] = title_count + 1
+        if title_count:
+            deferred.append((title_count, photo))
             print(f"{photo['title']} =>", file=sys.stderr)
         else:
             filtered.append(photo)
-            seen_titles.append(photo['title'])
             print(f"{photo['title']} +", file=sys.stderr)
 
-    if defer_remainder and len(deferred) > 0:
-        filtered = filtered + unique_titles(deferred, True)
+    if defer_remainder:
+        # Each title's second photos, then its third, etc; sort is stable so they stay in order within each round
+        deferred.sort(key=lambda counted: counted[0])
+        filtered.extend(photo for _, photo in deferred)
 
     return filtered
 
 
+def schedule_title_gap(photos: List[Photo], min_gap: int) -> List[Photo]:
+    """
+    Order photos, one per day, so that photos with the same title are at least min_gap days apart where possible.
+    Each day takes the title with the most photos left out of those not used in the last min_gap days; if every
+    title was used too recently, the one that's been waiting longest goes next, for the smallest shortfall.
+    Photos of each title keep their relative order, and titles with equal counts are taken in order of first
+    appearance, so shuffling the input randomizes the schedule.
+    :param photos:
+    :param min_gap: Minimum days between photos of one title
+    :return:
+    """
+    by_title: Dict[str, Deque[Photo]] = {}
+    for photo in photos:
+        by_title.setdefault(photo['title'], deque()).append(photo)
+
+    # A title with too many photos to keep min_gap apart is spread evenly over the schedule instead
+    gaps = {title: max(1, min(min_gap, len(photos) // len(title_photos))) for title, title_photos in by_title.items()}
+
+    # Titles free to use, most photos left first; then titles used recently, soonest free first
+    ready = [(-len(title_photos), order, title) for order, (title, title_photos) in enumerate(by_title.items())]
+    heapq.heapify(ready)
+    waiting: List[Tuple[int, int, int, str]] = []  # (free from day, -photos left, order, title)
+
+    scheduled: List[Photo] = []
+    for day in range(len(photos)):
+        while waiting and waiting[0][0] <= day:
+            _, remaining, order, title = heapq.heappop(waiting)
+            heapq.heappush(ready, (remaining, order, title))
+        if ready:
+            _, order, title = heapq.heappop(ready)
+        else:
+            _, _, order, title = heapq.heappop(waiting)
+
+        title_photos = by_title[title]
+        scheduled.append(title_photos.popleft())
+        if title_photos:
+            heapq.heappush(waiting, (day + gaps[title], -len(title_photos), order, title))
+
+    return scheduled
+
+
 def exclude_from_file(photos: List[Photo], exclusion_file: str) -> List[Photo]:
     """
 
@@ -111,22 +190,12 @@ def run_cli() -> None:
     :return:
     """
     args = parse_cli_args()
-    album_ids: List = args.album_id
-    flickr_reader = FlickrReader(init_flickr_client('./config.yml'))
-    flickr_reader.set_silent(True)
-    albums = [flickr_reader.scan_album(album_id) for album_id in album_ids]
-
-    filtered = albums.pop(0)
-    if args.any_subsequent_album:
-        print('Compositing subsequent albums', file=sys.stderr)
-        composite: List[Photo] = []
-        for album in albums:
-            composite = composite + album
-        filtered = photos_intersection(filtered, composite)
+    query: PhotoQuery = args.query or build_album_query(args.album_id, args.any_subsequent_album)
+    if args.catalog:
+        with PhotoCatalog(args.catalog, any_size=True) as catalog:  # only titles and dates are used
+            filtered = find_photos_in_catalog(args, query, catalog)
     else:
-        print('Calculating union of ALL albums', file=sys.stderr)
-        for album in albums:
-            filtered = photos_intersection(filtered, album)
+        filtered = find_photos_by_scanning(args, query)
 
     if args.unique_titles:
         filtered = unique_titles(filtered, False)  # used as a pure uniqueness function here
@@ -136,7 +205,71 @@ def run_cli() -> None:
 
     # report_files(filtered)
     from_date = datetime.strptime(args.from_date, '%Y%m%d').date() if args.from_date else date.today()
-    shuffle_and_prepend_date(filtered, from_date, args.csv)
+    shuffle_and_prepend_date(filtered, from_date, args.csv, args.min_title_gap)
+
+
+def init_flickr_reader(args: argparse.Namespace) -> FlickrReader:
+    """
+    Set up a quiet FlickrReader according to command-line arguments
+    :param args:
+    :return:
+    """
+    flickr_reader = FlickrReader(init_flickr_client('./config.yml'))
+    flickr_reader.set_silent(True)
+    flickr_reader.set_album_workers(args.album_workers)
+    return flickr_reader
+
+
+def find_photos_by_scanning(args: argparse.Namespace, query: PhotoQuery) -> List[Photo]:
+    """
+    Scan the query's albums (or fetch them from the cache) and evaluate it in memory
+    :param args:
+    :param query:
+    :return:
+    """
+    flickr_reader = init_flickr_reader(args)
+    if not args.no_cache:
+        flickr_reader.set_scan_cache(AlbumScanCache(args.cache_dir, args.cache_max_mb * 1024 * 1024))
+    album_photos = flickr_reader.scan_albums_separately(query.album_ids)
+    albums = {album_id: PhotoIndex(photos) for album_id, photos in zip(query.album_ids, album_photos)}
+
+    print(f'Evaluating {query.query}', file=sys.stderr)
+    photos = query.evaluate(albums).to_list()
+    return filter_taken_since(photos, args.taken_since)
+
+
+def find_photos_in_catalog(args: argparse.Namespace, query: PhotoQuery, catalog: PhotoCatalog) -> List[Photo]:
+    """
+    Bring the query's albums up to date in the catalog, unless --catalog-only, and evaluate it there
+    :param args:
+    :param query:
+    :param catalog:
+    :return:
+    """
+    if not args.catalog_only:
+        flickr_reader = init_flickr_reader(args)
+        flickr_reader.set_scan_cache(catalog)
+        flickr_reader.scan_albums_separately(query.album_ids)  # only changed albums are re-paged and recorded
+
+    missing = catalog.missing_albums(query.album_ids)
+    if missing:
+        print(f"Albums not in catalog: {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f'Evaluating {query.query} in catalog', file=sys.stderr)
+    return catalog.find_photos(query, args.taken_since)
+
+
+def filter_taken_since(photos: List[Photo], taken_since: Optional[str]) -> List[Photo]:
+    """
+    Keep only photos taken on or after a date, if given
+    :param photos:
+    :param taken_since: Date as Flickr gives it, eg '2021-06-01'
+    :return:
+    """
+    if not taken_since:
+        return photos
+    return [photo for photo in photos if photo['taken'] >= taken_since]
 
 
 def report_files(filtered: List[Photo]):
@@ -150,19 +283,21 @@ def report_files(filtered: List[Photo]):
     print("\n".join(filenames))
 
 
-def shuffle_and_prepend_date(photos: List[Photo], start: date, as_csv: bool = False):
+def shuffle_and_prepend_date(photos: List[Photo], start: date, as_csv: bool = False,
+                             min_title_gap: int = DEFAULT_MIN_TITLE_GAP):
     """
     Generate a random schedule on STDOUT
     :param photos:
     :param start:
     :param as_csv:
+    :param min_title_gap: Minimum days between photos with the same title, where possible
     :return:
     """
     csv_writer = csv.writer(sys.stdout) if as_csv else None
 
     # Make the photos random, but not too random
     random.shuffle(photos)
-    photos = unique_titles(photos, True)  # used to reduce clustering here
+    photos = schedule_title_gap(photos, min_title_gap)  # used to reduce clustering here
 
     filenames = [photo['local_file'] for photo in photos]
     today = start
@@ -4,13 +4,19 @@ Fetch one or more Flickr albums. Run with --help for details
 """
 
 import argparse
-import json
 import sys
+from itertools import islice
 from pathlib import Path
-from typing import Union
+from typing import Iterable, Iterator, List, Optional, Union
 
-from image_processors import Watermarker
-from phetch_tools import FlickrReader, PhotoListFetcher, init_flickr_client
+from image_processors import Watermarker, WatermarkPool
+from image_processors.watermarker import (DEFAULT_ENCODER_PROFILE,
+                                          ENCODER_PROFILES)
+from phetch_tools import (AlbumScanCache, FlickrReader, PhotoCatalog,
+                          PhotoListFetcher, PhotoListWriter,
+                          init_flickr_client)
+from phetch_tools.album_cache import DEFAULT_CACHE_DIR
+from phetch_tools.types import Photo
 
 
 def parse_cli_args() -> argparse.Namespace:
@@ -31,14 +37,34 @@ def parse_cli_args() -> argparse.Namespace:
     parser.add_argument('--apply-watermark', required=False, help='Add watermark to bottom right', type=str,
                         dest='watermark_file')
     parser.add_argument('--watermark-opacity', required=False, help='Set watermark opacity, 0-1', type=float)
+    parser.add_argument('--watermark-workers', required=False, type=int, default=0,
+                        help='Watermark on this many worker processes while downloading continues (0 = inline)')
+    parser.add_argument('--lossless-watermark', action='store_true',
+                        help='Re-encode only the watermarked corner of JPEGs, using jpegtran; '
+                             '--encoder-profile then only applies to images that fall back to a full re-encode')
+    parser.add_argument('--encoder-profile', help='Encoding for watermarked images; see README.md',
+                        choices=[name for name, profile in ENCODER_PROFILES.items() if profile['format'] == 'JPEG'])
     parser.add_argument('--limit', required=False, help='Max images to download', type=int, default=0)
     parser.add_argument('--delete-missing', help='Delete images not found in album', action="store_true")
     parser.add_argument('--sort-order', help='One of ', choices=PhotoListFetcher.get_sort_keys(), default='natural')
     parser.add_argument('--sort-reverse', help='Reverse sort order', action='store_true')
-    parser.add_argument('--save-photo-list', help='File to export JSON album index to')
+    parser.add_argument('--save-photo-list', help='File to export JSON album index to; name it .jsonl or .ndjson '
+                                                  'for JSON lines')
+    parser.add_argument('--scan-workers', help='Max album pages to fetch at once', type=int, default=4)
+    parser.add_argument('--album-workers', help='Max albums to scan at once', type=int, default=4)
+    parser.add_argument('--cache-dir', help='Directory for cached album scans', default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache-max-mb', help='Max size of album scan cache, in MB', type=int, default=64)
+    parser.add_argument('--no-cache', help="Rescan all albums and don't update the cache", action='store_true')
+    parser.add_argument('--catalog', help='SQLite photo catalog to record album scans in and reuse them from, '
+                                          'instead of the cache')
+    parser.add_argument('--jobs', help='Number of images to download at once', type=int, default=1)
+    parser.add_argument('--stream', help='Start downloading while albums are still being scanned '
+                                         '(natural sort order only)', action='store_true')
     args = parser.parse_args()
-    if args.watermark_opacity and not args.watermark_file:
-        print('--watermark-opacity is invalid without --apply-watermark')
+    if (args.watermark_opacity or args.watermark_workers or args.lossless_watermark or args.encoder_profile) \
+            and not args.watermark_file:
+        print('--watermark-opacity, --watermark-workers, --lossless-watermark and --encoder-profile '
+              'need --apply-watermark')
         parser.print_usage()
         sys.exit(1)
     if (not args.output and not args.no_download) or (args.output and args.no_download):
@@ -59,41 +85,175 @@ def run_cli() -> None:
     :return:
     """
     args = parse_cli_args()
+    if args.save_photo_list:
+        ensure_dir(Path(args.save_photo_list).parent)
+        with PhotoListWriter(args.save_photo_list) as photo_list:
+            fetch_albums(args, photo_list)
+        print(f"Wrote file list to {args.save_photo_list}")
+    else:
+        fetch_albums(args, None)
+
+    print('All done')
+
+
+def fetch_albums(args: argparse.Namespace, photo_list: Optional[PhotoListWriter]) -> None:
+    """
+    Scan albums and download their photos according to command-line arguments, adding them to a photo list if given
+    :param args:
+    :param photo_list:
+    :return:
+    """
+    flickr_reader = init_flickr_reader(args)
+    albums = args.album_id.split(',')
+    downloader = PhotoListFetcher()
+    downloader.set_jobs(args.jobs)
+
+    stream = args.stream and not args.no_download and downloader.can_stream_order(args.sort_order, args.sort_reverse)
+    if args.stream and not stream:
+        print('--stream needs natural, unreversed sort order and a download; scanning albums first')
+
+    if args.no_download:
+        # Nothing to order or download, so photos can go straight to the photo list as they're scanned
+        for _ in record_photos(flickr_reader.iter_albums(albums), None, photo_list):
+            pass
+        return
+
+    scan_limit = get_scan_limit(args)
+    photos: List[Photo] = []  # when streaming, filled in as we download if needed for --delete-missing
+    if not stream:
+        photos = scan_albums_first(flickr_reader, albums, scan_limit, photo_list)
+
+    output_dir = args.output.rstrip('/')
+    watermarker = init_watermarking(args, downloader)
+    limit = args.limit
+    ensure_dir(output_dir)
+    try:
+        if stream:
+            photo_stream = record_photos(flickr_reader.iter_albums(albums, scan_limit),
+                                         photos if args.delete_missing else None, photo_list)
+            downloader.fetch_photos(islice(photo_stream, limit) if limit else photo_stream, output_dir)
+            for _ in photo_stream:  # finish any scan still needed for --delete-missing and --save-photo-list
+                pass
+        else:
+            selected_photos = downloader.order_photo_list(photos, args.sort_order, args.sort_reverse, limit)
+            downloader.fetch_photos(selected_photos, output_dir)
+    except BaseException:
+        if watermarker:
+            finish_watermarking(watermarker, raise_error=False)  # keep the download error rather than a watermark one
+        raise
+    if watermarker:
+        finish_watermarking(watermarker)
+
+    if args.delete_missing:
+        downloader.remove_local_without_remote(photos, local_dir=output_dir)
+
+
+def scan_albums_first(flickr_reader: FlickrReader, albums: List[str], scan_limit: Optional[int],
+                      photo_list: Optional[PhotoListWriter]) -> List[Photo]:
+    """
+    Scan albums in full (or up to scan_limit) before any downloads, for ordering, adding them to a photo list if given
+    :param flickr_reader:
+    :param albums:
+    :param scan_limit:
+    :param photo_list:
+    :return:
+    """
+    if scan_limit:
+        photos = list(flickr_reader.iter_albums(albums, scan_limit))
+    else:
+        photos = flickr_reader.scan_albums(albums)
+    if photo_list:
+        photo_list.write_all(photos)
+    return photos
+
+
+def init_flickr_reader(args: argparse.Namespace) -> FlickrReader:
+    """
+    Set up a FlickrReader according to command-line arguments
+    :param args:
+    :return:
+    """
     flickr_reader = FlickrReader(init_flickr_client('./config.yml'))
     if args.suffix:
         flickr_reader.set_preferred_size_suffix(args.suffix)
+    flickr_reader.set_page_workers(args.scan_workers)
+    flickr_reader.set_album_workers(args.album_workers)
+    if args.catalog:
+        flickr_reader.set_scan_cache(PhotoCatalog(args.catalog))
+    elif not args.no_cache:
+        flickr_reader.set_scan_cache(AlbumScanCache(args.cache_dir, args.cache_max_mb * 1024 * 1024))
+    return flickr_reader
 
-    albums = args.album_id.split(',')
-    photos = flickr_reader.scan_albums(albums)
 
-    downloader = PhotoListFetcher()
-    if not args.no_download:
-        output_dir = args.output.rstrip('/')
-        if args.watermark_file:
-            watermarker = Watermarker(args.watermark_file)
-            if args.watermark_opacity:
-                watermarker.set_watermark_opacity(args.watermark_opacity)
-            downloader.set_post_download_callback(watermarker.mark_in_place)
-
-        limit = args.limit
-        sort = args.sort_order
-        reverse = args.sort_reverse
-
-        ensure_dir(output_dir)
-        selected_photos = downloader.order_photo_list(photos, sort, reverse, limit)
-        downloader.fetch_photos(selected_photos, output_dir)
-
-        if args.delete_missing:
-            downloader.remove_local_without_remote(photos, local_dir=output_dir)
-
-    photo_list = args.save_photo_list
-    if photo_list:
-        ensure_dir(Path(photo_list).parent)
-        with open(photo_list, 'w') as json_out:
-            json.dump(photos, json_out)
-            print(f"Wrote file list to {photo_list}")
+def init_watermarking(args: argparse.Namespace,
+                      downloader: PhotoListFetcher) -> Optional[Union[Watermarker, WatermarkPool]]:
+    """
+    Set up watermarking of downloads, if requested, either inline or on a pool of worker processes
+    :param args:
+    :param downloader:
+    :return: The Watermarker or pool; a pool must be closed once downloads are done
+    """
+    if not args.watermark_file:
+        return None
 
-    print('All done')
+    encoder_profile = args.encoder_profile or DEFAULT_ENCODER_PROFILE
+    if args.watermark_workers:
+        watermark_pool = WatermarkPool(args.watermark_file, args.watermark_opacity, args.watermark_workers,
+                                       lossless=args.lossless_watermark, encoder_profile=encoder_profile)
+        downloader.set_post_download_callback(watermark_pool.submit)
+        return watermark_pool
+
+    watermarker = Watermarker(args.watermark_file)
+    if args.watermark_opacity:
+        watermarker.set_watermark_opacity(args.watermark_opacity)
+    if args.lossless_watermark:
+        watermarker.set_lossless(True)
+    watermarker.set_encoder_profile(encoder_profile)
+    downloader.set_post_download_callback(watermarker.mark_in_place)
+    return watermarker
+
+
+def finish_watermarking(watermarker: Union[Watermarker, WatermarkPool], raise_error: bool = True) -> None:
+    """
+    Wait for any pool to finish, then report on the watermarked files written
+    :param watermarker:
+    :param raise_error: False to not raise any error from the pool, as WatermarkPool.close
+    :return:
+    """
+    if isinstance(watermarker, WatermarkPool):
+        watermarker.close(raise_error)
+    if watermarker.encode_stats.totals:
+        print(watermarker.encode_stats.report())
+
+
+def get_scan_limit(args: argparse.Namespace) -> Optional[int]:
+    """
+    Find how many photos need scanning, if a natural-order limit means we can stop before the end of the albums.
+    Only --delete-missing and --save-photo-list need every photo.
+    :param args:
+    :return:
+    """
+    if args.limit and PhotoListFetcher.can_stream_order(args.sort_order, args.sort_reverse) \
+            and not (args.delete_missing or args.save_photo_list):
+        return args.limit
+    return None
+
+
+def record_photos(photos: Iterable[Photo], record: Optional[List[Photo]],
+                  photo_list: Optional[PhotoListWriter]) -> Iterator[Photo]:
+    """
+    Pass photos through from a stream, appending each to a list and writing it to a photo list as it goes by
+    :param photos:
+    :param record:
+    :param photo_list:
+    :return:
+    """
+    for photo in photos:
+        if record is not None:
+            record.append(photo)
+        if photo_list:
+            photo_list.write(photo)
+        yield photo
 
 
 def ensure_dir(target_dir: Union[Path, str]):
@@ -1,7 +1,14 @@
+from .album_cache import AlbumScanCache
+from .catalog import PhotoCatalog
 from .flickr_reader import FlickrReader
 from .gps import GPS
 from .init_flickr import init_flickr_client
 from .load_config import load_config
+from .photo_index import PhotoIndex, PhotoQuery
+from .photo_list import PhotoListWriter
 from .photo_list_fetcher import PhotoListFetcher
+from .photo_record import PhotoRecord
+from .rate_controller import RateController
 
-__all__ = ['FlickrReader', 'PhotoListFetcher', 'load_config', 'init_flickr_client', 'GPS' ]
+__all__ = ['AlbumScanCache', 'FlickrReader', 'PhotoListFetcher', 'load_config', 'init_flickr_client', 'GPS',
+           'PhotoCatalog', 'PhotoIndex', 'PhotoListWriter', 'PhotoQuery', 'PhotoRecord', 'RateController']
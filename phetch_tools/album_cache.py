@@ -0,0 +1,103 @@
+"""
+Class file for AlbumScanCache
+"""
+import json
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Union
+
+from .photo_record import PhotoRecord, photo_json_default
+from .types import Photo
+
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'phetch'
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class AlbumScanCache:
+    """
+    On-disk store of album scan results, validated against the photoset's date_update and photo count
+
+    Note that Flickr doesn't bump an album's date_update when a member photo is retitled, so titles
+    can lag until the album itself next changes.
+    """
+    cache_dir: Path
+    max_bytes: int
+
+    def __init__(self, cache_dir: Union[Path, str] = DEFAULT_CACHE_DIR,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def get(self, album_id: str, size_suffix: Optional[str], date_update: str, count: int) -> Optional[List[Photo]]:
+        """
+        Return the cached photo list for an album, if present and still current
+        :param album_id:
+        :param size_suffix:
+        :param date_update:
+        :param count:
+        :return:
+        """
+        cache_file = self.cache_file(album_id, size_suffix)
+        try:
+            with open(cache_file, encoding='UTF-8') as cache_fp:
+                entry = json.load(cache_fp)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('date_update') != str(date_update) or entry.get('count') != int(count):
+            return None
+
+        os.utime(cache_file)  # mark as recently used for eviction
+        return [PhotoRecord.from_dict(photo) for photo in entry['photos']]
+
+    def put(self, album_id: str, size_suffix: Optional[str], date_update: str, count: int,
+            photos: List[Photo]) -> None:
+        """
+        Store the photo list for an album, then trim the cache to size
+        :param album_id:
+        :param size_suffix:
+        :param date_update:
+        :param count:
+        :param photos:
+        :return:
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {'album_id': album_id, 'date_update': str(date_update), 'count': int(count), 'photos': photos}
+        # Write to a temp file and rename, so concurrent scans never see a partial entry
+        with NamedTemporaryFile('w', encoding='UTF-8', dir=self.cache_dir, suffix='.tmp', delete=False) as temp_fp:
+            json.dump(entry, temp_fp, default=photo_json_default)
+        os.replace(temp_fp.name, self.cache_file(album_id, size_suffix))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache fits within max_bytes
+        :return:
+        """
+        entries = []
+        for cache_file in self.cache_dir.glob('*.json'):
+            try:
+                stat = cache_file.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, cache_file))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, cache_file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                cache_file.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def cache_file(self, album_id: str, size_suffix: Optional[str]) -> Path:
+        """
+        Path of the cache entry for an album; photo URLs depend on the preferred size, so it's part of the key
+        :param album_id:
+        :param size_suffix:
+        :return:
+        """
+        return self.cache_dir / f'{album_id}_{size_suffix or "o"}.json'
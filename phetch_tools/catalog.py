@@ -0,0 +1,253 @@
+"""
+Class file for PhotoCatalog
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from .photo_index import PhotoIndex, PhotoQuery, QueryNode
+from .photo_record import PhotoRecord
+from .types import Photo
+
+CATALOG_VERSION = 1  # stored as the database's user_version
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS albums (
+    album_id TEXT NOT NULL,
+    size_suffix TEXT NOT NULL,
+    date_update TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    scanned_at TEXT NOT NULL,
+    PRIMARY KEY (album_id, size_suffix)
+);
+CREATE TABLE IF NOT EXISTS photos (
+    photo_id TEXT PRIMARY KEY,
+    local_file TEXT NOT NULL,
+    title TEXT NOT NULL,
+    taken TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS photos_taken ON photos (taken);
+CREATE TABLE IF NOT EXISTS album_photos (
+    album_id TEXT NOT NULL,
+    size_suffix TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    photo_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (album_id, size_suffix, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS album_photos_photo ON album_photos (photo_id);
+CREATE TABLE IF NOT EXISTS photo_info (
+    photo_id TEXT NOT NULL,
+    method TEXT NOT NULL,
+    response TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (photo_id, method)
+);
+'''
+
+
+class PhotoCatalog:
+    """
+    Local SQLite catalog of album scans, album membership and per-photo API responses, shared by the scripts.
+
+    Usable as a FlickrReader scan cache: albums are only re-paged when their date_update or photo count changes,
+    and the catalog is updated album by album as they are scanned. Album queries then run against its indexes.
+    Photo URLs depend on the size scanned for, so scans are kept per album and size; callers that don't use the URLs
+    can set any_size to take a current scan at whatever size it was made.
+    """
+    path: Path
+    any_size: bool
+    connection: sqlite3.Connection
+
+    def __init__(self, path: Union[Path, str], any_size: bool = False) -> None:
+        self.path = Path(path)
+        self.any_size = any_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Scans may be recorded from FlickrReader's worker threads, so share one connection under a lock
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] < CATALOG_VERSION:
+                # Album scans from before they were kept per size; they are recorded again as albums are next scanned
+                self.connection.executescript('DROP TABLE IF EXISTS album_photos; DROP TABLE IF EXISTS albums;')
+            self.connection.executescript(CATALOG_SCHEMA)
+            self.connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def __enter__(self) -> 'PhotoCatalog':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the catalog database
+        :return:
+        """
+        with self.lock:
+            self.connection.close()
+
+    def get(self, album_id: str, size_suffix: Optional[str], date_update: str, count: int) -> Optional[List[Photo]]:
+        """
+        Return an album's photos as last scanned at this size, or at any size if any_size is set, if that scan is
+        still current; as AlbumScanCache.get
+        :param album_id:
+        :param size_suffix:
+        :param date_update:
+        :param count:
+        :return:
+        """
+        size_suffix = size_suffix or 'o'
+        with self.lock:
+            album = self.connection.execute(
+                'SELECT size_suffix FROM albums WHERE album_id = ? AND date_update = ? AND count = ? '
+                'ORDER BY size_suffix != ?, scanned_at DESC', (album_id, str(date_update), int(count), size_suffix)
+            ).fetchone()
+            if album is None or (album[0] != size_suffix and not self.any_size):
+                return None
+            rows = self.connection.execute(
+                'SELECT ap.url, p.local_file, p.title, p.taken FROM album_photos ap '
+                'JOIN photos p ON p.photo_id = ap.photo_id WHERE ap.album_id = ? AND ap.size_suffix = ? '
+                'ORDER BY ap.position', (album_id, album[0])
+            ).fetchall()
+        return [PhotoRecord(*row) for row in rows]
+
+    def put(self, album_id: str, size_suffix: Optional[str], date_update: str, count: int,
+            photos: List[Photo]) -> None:
+        """
+        Record a complete scan of an album, replacing any earlier one at the same size; as AlbumScanCache.put
+        :param album_id:
+        :param size_suffix:
+        :param date_update:
+        :param count:
+        :param photos:
+        :return:
+        """
+        photo_ids = [PhotoIndex.photo_id(photo) for photo in photos]
+        size_suffix = size_suffix or 'o'
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO albums (album_id, size_suffix, date_update, count, scanned_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (album_id, size_suffix, str(date_update), int(count), datetime.now().isoformat())
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO photos (photo_id, local_file, title, taken) VALUES (?, ?, ?, ?)',
+                ((photo_id, photo['local_file'], photo['title'], photo['taken'])
+                 for photo_id, photo in zip(photo_ids, photos))
+            )
+            self.connection.execute(
+                'DELETE FROM album_photos WHERE album_id = ? AND size_suffix = ?', (album_id, size_suffix)
+            )
+            self.connection.executemany(
+                'INSERT INTO album_photos (album_id, size_suffix, position, photo_id, url) VALUES (?, ?, ?, ?, ?)',
+                ((album_id, size_suffix, position, photo_id, photo['url'])
+                 for position, (photo_id, photo) in enumerate(zip(photo_ids, photos)))
+            )
+
+    def missing_albums(self, album_ids: List[str]) -> List[str]:
+        """
+        List those of the given albums that have never been scanned into the catalog
+        :param album_ids:
+        :return:
+        """
+        with self.lock:
+            known = {row[0] for row in self.connection.execute('SELECT DISTINCT album_id FROM albums')}
+        return [album_id for album_id in album_ids if album_id not in known]
+
+    def find_photos(self, query: PhotoQuery, taken_since: Optional[str] = None) -> List[Photo]:
+        """
+        Evaluate an album query against the catalog, optionally keeping only photos taken on or after a date.
+        Results are in the same order as from PhotoQuery.evaluate on scanned albums. Each album is taken from its
+        latest scan, at whatever size.
+        :param query:
+        :param taken_since: Date or datetime as Flickr gives it, eg '2021-06-01'
+        :return:
+        """
+        steps: List[str] = []
+        params: List[Any] = []
+        result = self.compile_query(query.tree, steps, params)
+        taken_filter = ''
+        if taken_since:
+            taken_filter = 'WHERE p.taken >= ?'
+            params.append(taken_since)
+        sql = (f'WITH {", ".join(steps)} SELECT m.url, p.local_file, p.title, p.taken FROM {result} m '
+               f'JOIN photos p ON p.photo_id = m.photo_id {taken_filter} ORDER BY m.sort_key')
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [PhotoRecord(*row) for row in rows]
+
+    def compile_query(self, node: QueryNode, steps: List[str], params: List[Any]) -> str:
+        """
+        Convert a PhotoQuery tree to common table expressions of (photo_id, url, sort_key), one per node,
+        each album being a lookup on the index of its latest scan. Like PhotoIndex, results keep the order of the left
+        operand, with a union's right-hand extras after; sort keys are built up as strings so that this holds at any
+        depth.
+        :param node:
+        :param steps: Common table expressions, added to in order
+        :param params: Parameters for the expressions, added to in order
+        :return: Name of the expression for this node
+        """
+        if isinstance(node, str):
+            sql = ("SELECT photo_id, url, printf('%010d', position) FROM album_photos "
+                   "WHERE album_id = ? AND size_suffix = "
+                   "(SELECT size_suffix FROM albums WHERE album_id = ? ORDER BY scanned_at DESC LIMIT 1)")
+            params += [node, node]
+        else:
+            operator, left_node, right_node = node
+            left = self.compile_query(left_node, steps, params)
+            right = self.compile_query(right_node, steps, params)
+            if operator == '|':
+                sql = (f"SELECT photo_id, url, '0' || sort_key FROM {left} UNION ALL "
+                       f"SELECT photo_id, url, '1' || sort_key FROM {right} "
+                       f"WHERE photo_id NOT IN (SELECT photo_id FROM {left})")
+            else:
+                sql = (f"SELECT photo_id, url, sort_key FROM {left} "
+                       f"WHERE photo_id {'IN' if operator == '&' else 'NOT IN'} (SELECT photo_id FROM {right})")
+        name = f'step{len(steps)}'
+        steps.append(f'{name} (photo_id, url, sort_key) AS ({sql})')
+        return name
+
+    def get_photo_info(self, photo_id: str, method: str) -> Optional[Dict]:
+        """
+        Return a stored API response for a photo, if any
+        :param photo_id:
+        :param method: API method below flickr.photos, eg 'getInfo'
+        :return:
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT response FROM photo_info WHERE photo_id = ? AND method = ?', (photo_id, method)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_photo_info(self, photo_id: str, info: Dict) -> None:
+        """
+        Store a freshly fetched getInfo response for a photo. If the photo has been edited or replaced since the
+        stored one (going by dates.lastupdate), its other stored responses are out of date and are dropped.
+        :param photo_id:
+        :param info: flickr.photos.getInfo response
+        :return:
+        """
+        stored = self.get_photo_info(photo_id, 'getInfo')
+        last_update = info['photo']['dates']['lastupdate']
+        if stored is None or stored['photo']['dates']['lastupdate'] != last_update:
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM photo_info WHERE photo_id = ?', (photo_id,))
+        self.put_photo_info(photo_id, 'getInfo', info)
+
+    def put_photo_info(self, photo_id: str, method: str, response: Dict) -> None:
+        """
+        Store an API response for a photo, replacing any earlier one
+        :param photo_id:
+        :param method: API method below flickr.photos, eg 'getInfo'
+        :param response:
+        :return:
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO photo_info (photo_id, method, response, fetched_at) VALUES (?, ?, ?, ?)',
+                (photo_id, method, json.dumps(response), datetime.now().isoformat())
+            )
@@ -1,10 +1,20 @@
 """
 Class file for FlickrReader
 """
-from typing import Any, List, Optional
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
+import requests
+from flickrapi.exceptions import FlickrError
 from pathvalidate import sanitize_filename
 
+from phetch_tools.album_cache import AlbumScanCache
+from phetch_tools.catalog import PhotoCatalog
+from phetch_tools.photo_record import PhotoRecord
+from phetch_tools.rate_controller import (RETRYABLE_STATUSES, RateController,
+                                          RetryableError)
 from phetch_tools.types import Photo
 
 # Sample Photo response:
@@ -14,17 +24,27 @@ from phetch_tools.types import Photo
 #  'url_o': 'https://live.staticflickr.com/65535/50653354368_f94bcc957f_o.jpg', 'height_o': 4640, 'width_o': 6960,
 #  'url_k': 'https://live.staticflickr.com/65535/50653354368_6b9562a359_k.jpg', 'height_k': 1365, 'width_k': 2048}
 
+FLICKR_SERVICE_UNAVAILABLE = 105
+
 
 class FlickrReader:
     """
     Flickr album downloader
     """
     preferred_size: Optional[str]
+    page_workers: int
+    album_workers: int
+    scan_cache: Optional[Union[AlbumScanCache, PhotoCatalog]]
+    rate_controller: RateController
 
     def __init__(self, flickr_client: Any) -> None:
         self.preferred_size = None
         self.flickr = flickr_client
         self.silent = False
+        self.page_workers = 4  # default
+        self.album_workers = 1  # default; scan albums one at a time
+        self.scan_cache = None
+        self.rate_controller = RateController(rate=5.0, max_rate=10.0)  # default
 
     def set_silent(self, silent: bool) -> 'FlickrReader':
         """
@@ -44,21 +64,87 @@ class FlickrReader:
         self.preferred_size = suffix
         return self
 
+    def set_page_workers(self, workers: int) -> 'FlickrReader':
+        """
+        Set the maximum number of album pages to fetch concurrently once the page count is known
+        :param workers:
+        :return:
+        """
+        self.page_workers = max(1, int(workers))
+        return self
+
+    def set_album_workers(self, workers: int) -> 'FlickrReader':
+        """
+        Set the maximum number of albums to scan concurrently in scan_albums / scan_albums_separately
+        :param workers:
+        :return:
+        """
+        self.album_workers = max(1, int(workers))
+        return self
+
+    def set_scan_cache(self, scan_cache: Optional[Union[AlbumScanCache, PhotoCatalog]]) -> 'FlickrReader':
+        """
+        Set a cache, or a PhotoCatalog, to serve unchanged albums from instead of re-paging them
+        :param scan_cache:
+        :return:
+        """
+        self.scan_cache = scan_cache
+        return self
+
+    def set_rate_controller(self, rate_controller: RateController) -> 'FlickrReader':
+        """
+        Set the controller used to pace and retry API calls
+        :param rate_controller:
+        :return:
+        """
+        self.rate_controller = rate_controller
+        return self
+
+    def call_api(self, method: Callable[..., Dict], **kwargs: Any) -> Dict:
+        """
+        Call a Flickr API method at a controlled rate, retrying on throttling, server errors and dropped connections
+        :param method: eg self.flickr.photosets.getInfo
+        :param kwargs:
+        :return:
+        """
+        def attempt() -> Dict:
+            try:
+                return method(**kwargs)
+            except FlickrError as err:
+                status = re.search(r'Status code (\d+)', str(err))
+                if err.code == FLICKR_SERVICE_UNAVAILABLE or (status and int(status.group(1)) in RETRYABLE_STATUSES):
+                    raise RetryableError(f'Flickr API: {err}') from err
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                raise RetryableError(f'Flickr API: {err}') from err
+
+        return self.rate_controller.call(attempt)
+
     def scan_albums(self, albums: List[str]) -> List[Photo]:
         """
         Scan albums, given as a range of IDs, for potential dowloads
-        :param limit:
         :param albums:
-        :param output:
         :return:
         """
         photo_list = []  # List[Photo]
 
-        for album in albums:
-            photo_list += self.scan_album(album)
+        for album_photos in self.scan_albums_separately(albums):
+            photo_list += album_photos
 
         return photo_list
 
+    def scan_albums_separately(self, albums: List[str]) -> List[List[Photo]]:
+        """
+        Scan albums, given as a range of IDs, returning one list of Photos per album in the order given
+        :param albums:
+        :return:
+        """
+        if self.album_workers == 1 or len(albums) < 2:
+            return [self.scan_album(album) for album in albums]
+
+        with ThreadPoolExecutor(max_workers=min(self.album_workers, len(albums))) as executor:
+            return list(executor.map(self.scan_album, albums))
+
     def local_filename_for_photo(self, photo, path: str = ""):
         """
         Create a local filename for a photo API object
@@ -95,8 +181,8 @@ class FlickrReader:
         if not self.silent:
             print(f'Fetching {album_id}, page {page}')
         extras = "date_taken,url_o" + (",url_" + self.preferred_size if self.preferred_size else "")
-        photoset_response = self.flickr.photosets.getPhotos(
-            photoset_id=album_id, extras=extras, page=page, media='photos'
+        photoset_response = self.call_api(
+            self.flickr.photosets.getPhotos, photoset_id=album_id, extras=extras, page=page, media='photos'
         )
         return photoset_response
 
@@ -106,36 +192,127 @@ class FlickrReader:
         :param album:
         :return:
         """
-        photos = []  # List[Photo]
-        album_response = self.flickr.photosets.getInfo(photoset_id=album)
+        return list(self.iter_album(album))
+
+    def iter_albums(self, albums: List[str], limit: Optional[int] = None) -> Iterator[Photo]:
+        """
+        Yield Photos from a range of albums in order, as each page of each album arrives
+        :param albums:
+        :param limit: Stop, without fetching further pages, once this many photos have been yielded
+        :return:
+        """
+        remaining = limit
+        for album in albums:
+            if remaining is not None and remaining <= 0:
+                return
+            for photo in self.iter_album(album, remaining):
+                yield photo
+                if remaining is not None:
+                    remaining -= 1
+
+    def iter_album(self, album: str, limit: Optional[int] = None) -> Iterator[Photo]:
+        """
+        Yield Photos from an album page by page, while later pages are still being fetched
+        :param album:
+        :param limit: Yield at most this many photos, only fetching the pages needed for them
+        :return:
+        """
+        album_response = self.call_api(self.flickr.photosets.getInfo, photoset_id=album)
         album_title = album_response['photoset']['title']['_content']
+        date_update = album_response['photoset']['date_update']
+        count = int(album_response['photoset'].get('count_photos', album_response['photoset']['photos']))
+
+        if self.scan_cache:
+            cached_photos = self.scan_cache.get(album, self.preferred_size, date_update, count)
+            if cached_photos is not None:
+                if not self.silent:
+                    print(f'Album {album_title} ({album}) unchanged, using cached scan')
+                yield from (cached_photos if limit is None else cached_photos[:limit])
+                return
+
         if not self.silent:
             print(f'Scanning album {album_title} ({album})')
 
-        page = 1
-        photoset_response = self.fetch_photoset_photos(album, page)
-        pages = int(photoset_response['photoset']['pages'])
-
-        while page <= pages:
-            album_photos = photoset_response['photoset']['photo']
-            for album_photo in album_photos:
-                filename = self.local_filename_for_photo(album_photo)
-                photo_url = album_photo["url_o"]
-                if self.preferred_size and "url_" + self.preferred_size in album_photo:
-                    photo_url = album_photo["url_" + self.preferred_size]
-
-                photo: Photo = {
-                    'url': photo_url,
-                    'local_file': filename,
-                    'title': album_photo['title'],
-                    'taken': album_photo['datetaken']
-                }
-                photos.append(photo)
-
-            page += 1
-            if page <= pages:
-                if not self.silent:
-                    print(f' Fetch page {page}/{pages}')
-                photoset_response = self.fetch_photoset_photos(album, page)
+        first_page_photos, pages, per_page = self.fetch_first_photoset_page(album)
+        last_page = pages
+        if limit is not None:
+            last_page = min(pages, max(1, -(-limit // per_page)))  # ceiling division
+        # Only a complete scan is cached; otherwise photos need not be held once yielded
+        photos: Optional[List[Photo]] = [] if self.scan_cache is not None and last_page == pages else None
+
+        yielded = 0
+        for page_photos in self.iter_photoset_pages(album, first_page_photos, last_page):
+            if photos is not None:
+                photos += page_photos
+            if limit is not None:
+                page_photos = page_photos[:limit - yielded]
+            yielded += len(page_photos)
+            yield from page_photos
+
+        if photos is not None and self.scan_cache is not None:
+            self.scan_cache.put(album, self.preferred_size, date_update, count, photos)
+
+    def fetch_first_photoset_page(self, album: str) -> Tuple[List[Photo], int, int]:
+        """
+        Fetch the Photos on the first page of an album, with the album's page count and page size
+        :param album:
+        :return: photos, pages, per_page
+        """
+        photoset_response = self.fetch_photoset_photos(album, 1)
+        return (self.photos_from_photoset_response(photoset_response), int(photoset_response['photoset']['pages']),
+                int(photoset_response['photoset']['perpage']))
+
+    def fetch_photoset_page_photos(self, album: str, page: int) -> List[Photo]:
+        """
+        Fetch the Photos on one page of an album; the raw response is dropped as soon as it's converted
+        :param album:
+        :param page:
+        :return:
+        """
+        return self.photos_from_photoset_response(self.fetch_photoset_photos(album, page))
+
+    def iter_photoset_pages(self, album: str, first_page_photos: List[Photo], last_page: int) -> Iterator[List[Photo]]:
+        """
+        Yield the Photos on each page of an album up to last_page, in page order, given those on page 1
+        :param album:
+        :param first_page_photos:
+        :param last_page:
+        :return:
+        """
+        yield first_page_photos
+        if last_page < 2:
+            return
+
+        # Page 1 gave us the page count, so queue the rest at once and hand them on in page order
+        with ThreadPoolExecutor(max_workers=min(self.page_workers, last_page - 1)) as executor:
+            futures = deque(executor.submit(self.fetch_photoset_page_photos, album, page)
+                            for page in range(2, last_page + 1))
+            try:
+                while futures:
+                    yield futures.popleft().result()  # popped, so each page is freed once the caller is done with it
+            finally:
+                # Don't fetch pages nobody will read if the caller stops early
+                for future in futures:
+                    future.cancel()
+
+    def photos_from_photoset_response(self, photoset_response: Dict) -> List[Photo]:
+        """
+        Convert one page of a photosets.getPhotos response to a list of Photos
+        :param photoset_response:
+        :return:
+        """
+        photos: List[Photo] = []
+        for album_photo in photoset_response['photoset']['photo']:
+            filename = self.local_filename_for_photo(album_photo)
+            photo_url = album_photo["url_o"]
+            if self.preferred_size and "url_" + self.preferred_size in album_photo:
+                photo_url = album_photo["url_" + self.preferred_size]
+
+            photos.append(PhotoRecord(
+                url=photo_url,
+                local_file=filename,
+                title=album_photo['title'],
+                taken=album_photo['datetaken']
+            ))
 
         return photos
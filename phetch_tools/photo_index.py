@@ -0,0 +1,185 @@
+"""
+Class file for PhotoIndex and PhotoQuery
+"""
+import re
+from typing import (Dict, Iterable, Iterator, List, Mapping, Optional, Tuple,
+                    Union)
+
+from .types import Photo
+
+PHOTO_ID_PATTERN = re.compile(r'(?:^|_)(?P<photo_id>\d+)\.jpg$')  # local_file is title_slug_ID.jpg
+QUERY_TOKEN_PATTERN = re.compile(r'\s*(?:(?P<album>\d+)|(?P<word>[A-Za-z]+)|(?P<symbol>\S))')
+QUERY_OPERATORS = {'&': '&', 'AND': '&', '|': '|', 'OR': '|', '-': '-', 'NOT': '-'}
+
+QueryNode = Union[str, Tuple[str, 'QueryNode', 'QueryNode']]  # album ID, or (operator, left, right)
+
+
+class PhotoIndex:
+    """
+    Photos keyed by Flickr ID, in their original order, with set operations that run in linear time:
+    a & b (in both), a | b (in either) and a - b (in a but not b). Results keep the order of the left operand.
+    """
+    photos: Dict[str, Photo]
+
+    def __init__(self, photos: Iterable[Photo] = ()) -> None:
+        self.photos = {}
+        for photo in photos:
+            self.photos.setdefault(self.photo_id(photo), photo)
+
+    @staticmethod
+    def photo_id(photo: Photo) -> str:
+        """
+        Find the Flickr ID of a photo from its local filename, falling back to the whole filename
+        :param photo:
+        :return:
+        """
+        match = PHOTO_ID_PATTERN.search(photo['local_file'])
+        return match.group('photo_id') if match else photo['local_file']
+
+    @classmethod
+    def from_dict(cls, photos: Dict[str, Photo]) -> 'PhotoIndex':
+        """
+        Build an index from photos already keyed by ID
+        :param photos:
+        :return:
+        """
+        index = cls()
+        index.photos = photos
+        return index
+
+    def __and__(self, other: 'PhotoIndex') -> 'PhotoIndex':
+        return self.from_dict({key: photo for key, photo in self.photos.items() if key in other.photos})
+
+    def __or__(self, other: 'PhotoIndex') -> 'PhotoIndex':
+        photos = dict(self.photos)
+        for key, photo in other.photos.items():
+            photos.setdefault(key, photo)
+        return self.from_dict(photos)
+
+    def __sub__(self, other: 'PhotoIndex') -> 'PhotoIndex':
+        return self.from_dict({key: photo for key, photo in self.photos.items() if key not in other.photos})
+
+    def __len__(self) -> int:
+        return len(self.photos)
+
+    def __iter__(self) -> Iterator[Photo]:
+        return iter(self.photos.values())
+
+    def __contains__(self, photo: Photo) -> bool:
+        return self.photo_id(photo) in self.photos
+
+    def to_list(self) -> List[Photo]:
+        """
+        List the photos in the index, in order
+        :return:
+        """
+        return list(self.photos.values())
+
+
+class PhotoQuery:
+    """
+    A set expression over album IDs, eg "111 & (222 | 333) - 444", to evaluate against PhotoIndexes.
+    Operators are & (or AND), | (or OR) and - (or NOT, or AND NOT); & and - bind tighter than |,
+    and parentheses group as usual.
+    """
+    query: str
+    tree: QueryNode
+    album_ids: List[str]  # in order of first appearance
+
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.tokens = self.tokenize(query)
+        self.position = 0
+        self.album_ids = []
+        self.tree = self.parse_union()
+        if self.position < len(self.tokens):
+            raise ValueError(f'Unexpected "{self.tokens[self.position]}" in query "{query}"')
+
+    @staticmethod
+    def tokenize(query: str) -> List[str]:
+        """
+        Split a query into album IDs, operators and parentheses
+        :param query:
+        :return:
+        """
+        tokens = []
+        for match in QUERY_TOKEN_PATTERN.finditer(query.strip()):
+            if match.group('word'):
+                word = match.group('word').upper()
+                if word not in QUERY_OPERATORS:
+                    raise ValueError(f'Unknown operator "{match.group("word")}" in query "{query}"')
+                tokens.append(word)
+            else:
+                tokens.append(match.group('album') or match.group('symbol'))
+        return tokens
+
+    def evaluate(self, albums: Mapping[str, PhotoIndex], node: Optional[QueryNode] = None) -> PhotoIndex:
+        """
+        Evaluate the query (or part of it) against indexes of each album's photos
+        :param albums: PhotoIndex for each album ID in album_ids
+        :param node:
+        :return:
+        """
+        node = self.tree if node is None else node
+        if isinstance(node, str):
+            return albums[node]
+        operator, left, right = node
+        left_index = self.evaluate(albums, left)
+        right_index = self.evaluate(albums, right)
+        if operator == '&':
+            return left_index & right_index
+        if operator == '|':
+            return left_index | right_index
+        return left_index - right_index
+
+    def parse_union(self) -> QueryNode:
+        """
+        union := intersection (| intersection)*
+        :return:
+        """
+        node = self.parse_intersection()
+        while self.peek() in ('|', 'OR'):
+            self.position += 1
+            node = ('|', node, self.parse_intersection())
+        return node
+
+    def parse_intersection(self) -> QueryNode:
+        """
+        intersection := operand ((& | - | AND NOT) operand)*
+        :return:
+        """
+        node = self.parse_operand()
+        while self.peek() in ('&', 'AND', '-', 'NOT'):
+            operator = QUERY_OPERATORS[self.tokens[self.position]]
+            self.position += 1
+            if operator == '&' and self.peek() == 'NOT':
+                operator = '-'
+                self.position += 1
+            node = (operator, node, self.parse_operand())
+        return node
+
+    def parse_operand(self) -> QueryNode:
+        """
+        operand := album_id | ( union )
+        :return:
+        """
+        token = self.peek()
+        self.position += 1
+        if token is not None and token.isdigit():
+            if token not in self.album_ids:
+                self.album_ids.append(token)
+            return token
+        if token == '(':
+            node = self.parse_union()
+            if self.peek() != ')':
+                raise ValueError(f'Missing ")" in query "{self.query}"')
+            self.position += 1
+            return node
+        raise ValueError(f'Expected an album ID or "(" but found {token or "end"} in query "{self.query}"')
+
+    def peek(self) -> Optional[str]:
+        """
+        The next token, if any
+        :return:
+        """
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
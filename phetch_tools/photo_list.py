@@ -0,0 +1,131 @@
+"""
+Class file for PhotoListWriter, and reading of photo lists
+"""
+import json
+import os
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, Optional, Union
+
+from .photo_record import PhotoRecord, photo_json_default
+from .types import Photo
+
+JSON_LINES_SUFFIXES = ('.jsonl', '.ndjson')
+
+
+def is_json_lines_file(path: Union[Path, str]) -> bool:
+    """
+    Report whether a photo list filename calls for JSON lines (one photo per line) rather than a JSON array
+    :param path:
+    :return:
+    """
+    return Path(path).suffix.lower() in JSON_LINES_SUFFIXES
+
+
+def iter_photo_list(lines: Iterable[str]) -> Iterator[Photo]:
+    """
+    Yield Photos from the lines of a photo list as they arrive. JSON lines are read one photo at a time;
+    a plain JSON array, recognised by its leading '[', has to be read whole first.
+    :param lines: eg an open file, or response.iter_lines(decode_unicode=True)
+    :return:
+    """
+    lines = iter(lines)
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('['):
+            photos = json.loads('\n'.join([line, *lines]))
+            yield from (photo_from_list(photo, f'entry {index}') for index, photo in enumerate(photos, 1))
+            return
+        yield photo_from_list(json.loads(line), f'line {line_number}')
+
+
+def photo_from_list(photo: Dict[str, str], position: str) -> Photo:
+    """
+    Convert a photo read from a photo list, saying where in the list it was if it lacks a required field
+    :param photo:
+    :param position: eg 'line 3'
+    :return:
+    """
+    try:
+        return PhotoRecord.from_dict(photo)
+    except KeyError as err:
+        raise ValueError(f'Photo list {position} has no {err} field') from err
+
+
+class PhotoListWriter:
+    """
+    Write a photo list one photo at a time, as JSON lines if the filename ends .jsonl or .ndjson, or as a JSON array.
+    Photos go to a partial file that is renamed into place on close, so the list is never left half-written.
+    """
+    path: Path
+    json_lines: bool
+    count: int
+    part_file: Path
+    output: Optional[IO[str]]
+
+    def __init__(self, path: Union[Path, str]) -> None:
+        self.path = Path(path)
+        self.json_lines = is_json_lines_file(self.path)
+        self.count = 0
+        self.part_file = self.path.with_name(self.path.name + '.part')
+        self.output = open(self.part_file, 'w', encoding='UTF-8')  # pylint: disable=consider-using-with
+        if not self.json_lines:
+            self.output.write('[')
+
+    def __enter__(self) -> 'PhotoListWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type:
+            self.discard()
+        else:
+            self.close()
+
+    def write(self, photo: Photo) -> None:
+        """
+        Add a photo to the list
+        :param photo:
+        :return:
+        """
+        if self.output is None:
+            raise ValueError(f'Photo list {self.path} is already closed')
+        photo_json = json.dumps(photo, default=photo_json_default)
+        if self.json_lines:
+            self.output.write(photo_json + '\n')
+        else:
+            self.output.write((', ' if self.count else '') + photo_json)  # as json.dump would lay out the array
+        self.count += 1
+
+    def write_all(self, photos: Iterable[Photo]) -> None:
+        """
+        Add each of a list or stream of photos to the list
+        :param photos:
+        :return:
+        """
+        for photo in photos:
+            self.write(photo)
+
+    def close(self) -> None:
+        """
+        Finish the list and move it into place
+        :return:
+        """
+        if self.output is None:
+            return
+        if not self.json_lines:
+            self.output.write(']')
+        self.output.close()
+        self.output = None
+        os.replace(self.part_file, self.path)
+
+    def discard(self) -> None:
+        """
+        Abandon the list, leaving any earlier one in place
+        :return:
+        """
+        if self.output is None:
+            return
+        self.output.close()
+        self.output = None
+        self.part_file.unlink()
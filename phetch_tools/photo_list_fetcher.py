@@ -1,13 +1,19 @@
 """
 Class file for PhotoListFetcher
 """
+import heapq
+import os
+import re
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
 from pathlib import Path
 from random import sample
-from time import sleep
-from typing import Callable, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from .rate_controller import RETRYABLE_STATUSES, RateController, RetryableError
 from .types import Photo, PhotoKey
 
 # Sample Photo response:
@@ -17,6 +23,14 @@ from .types import Photo, PhotoKey
 #  'url_o': 'https://live.staticflickr.com/65535/50653354368_f94bcc957f_o.jpg', 'height_o': 4640, 'width_o': 6960,
 #  'url_k': 'https://live.staticflickr.com/65535/50653354368_6b9562a359_k.jpg', 'height_k': 1365, 'width_k': 2048}
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class IncompleteDownloadError(IOError):
+    """
+    Downloaded file doesn't match the length the server reported
+    """
+
 
 # Set of "sort" functions; these actually subsample the list of fetched photos in a defined way
 def sort_natural(photos: List[Photo], limit: Optional[int] = None, reverse: bool = False) -> List[Photo]:
@@ -50,16 +64,17 @@ def sort_by_key(
         photos: List[Photo], key: PhotoKey, limit: Optional[int] = None, reverse: bool = False) -> List[Photo]:
     """
     Helper to sort photos by a given dict key
+    With a limit, only the top photos are selected (stably, as sorted() would) rather than sorting the whole list
     :param photos:
     :param key:
     :param limit:
     :param reverse:
     :return:
     """
-    photos = sorted(photos, key=lambda d: d[key], reverse=reverse)
-    if limit is not None:
-        photos = photos[:limit]
-    return photos
+    if limit is None:
+        return sorted(photos, key=lambda d: d[key], reverse=reverse)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(limit, photos, key=lambda d: d[key])
 
 
 def sort_title(photos: List[Photo], limit: Optional[int] = None, reverse: bool = False) -> List[Photo]:
@@ -95,10 +110,48 @@ class PhotoListFetcher:
         'taken': sort_taken,
     }
     post_download_callback: Optional[Callable[[str], None]]
+    jobs: int
+    timeout: float
+    rate_controller: RateController
 
     def __init__(self) -> None:
         self.preferred_size = None
         self.post_download_callback = None
+        self.timeout = 60.0  # default, seconds
+        self.rate_controller = RateController(rate=10.0, max_rate=50.0)  # default
+        self.session = requests.Session()
+        self.set_jobs(1)
+
+    def set_jobs(self, jobs: int) -> 'PhotoListFetcher':
+        """
+        Set the number of images to download at once
+        :param jobs:
+        :return:
+        """
+        self.jobs = max(1, int(jobs))
+        # Keep one pooled connection per worker, so concurrent downloads reuse rather than reopen them
+        adapter = HTTPAdapter(pool_maxsize=max(self.jobs, 10))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        return self
+
+    def set_rate_controller(self, rate_controller: RateController) -> 'PhotoListFetcher':
+        """
+        Set the controller used to pace and retry image requests
+        :param rate_controller:
+        :return:
+        """
+        self.rate_controller = rate_controller
+        return self
+
+    def set_timeout(self, timeout: float) -> 'PhotoListFetcher':
+        """
+        Set the connect and read timeout for each image request, in seconds
+        :param timeout:
+        :return:
+        """
+        self.timeout = float(timeout)
+        return self
 
     def set_post_download_callback(self, callback: Optional[Callable[[str], None]]) -> 'PhotoListFetcher':
         """
@@ -125,19 +178,55 @@ class PhotoListFetcher:
         selected_photos = self.sort_funcs[sort](photos, limit, reverse)
         return selected_photos
 
-    def fetch_photos(self, photos: List[Photo], output_dir: str):
+    @staticmethod
+    def can_stream_order(sort: str, reverse: bool) -> bool:
+        """
+        Report whether photos can be downloaded in the required order before the full list is known
+        :param sort:
+        :param reverse:
+        :return:
+        """
+        return sort == 'natural' and not reverse
+
+    def fetch_photos(self, photos: Iterable[Photo], output_dir: str):
         """
-        Fetch up to a maximum number of images from the calculated list
+        Fetch each image in a list or stream of photos, skipping those already present
         :param photos:
         :param output_dir:
-        :param limit:
         :return:
         """
-        for photo in photos:
-            outfile = output_dir + '/' + photo['local_file']
-            if not Path(outfile).exists():
-                self.download_image(photo['url'], outfile, True)
-                sleep(0.1)
+        if self.jobs == 1:
+            for photo in photos:
+                self.fetch_photo(photo, output_dir)
+            return
+
+        # Keep a bounded number of downloads in flight, so a long stream of photos is never all queued at once
+        in_flight: Dict[Future, str] = {}  # future: local_file
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for photo in photos:
+                # Don't download (and post-process) a repeated file twice; once finished, it's skipped as present
+                if photo['local_file'] in in_flight.values():
+                    continue
+                if len(in_flight) >= self.jobs * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del in_flight[future]
+                        future.result()  # re-raise any download error
+                in_flight[executor.submit(self.fetch_photo, photo, output_dir)] = photo['local_file']
+
+            for future in in_flight:
+                future.result()
+
+    def fetch_photo(self, photo: Photo, output_dir: str):
+        """
+        Fetch a single photo into a directory, unless already present
+        :param photo:
+        :param output_dir:
+        :return:
+        """
+        outfile = output_dir + '/' + photo['local_file']
+        if not Path(outfile).exists():
+            self.download_image(photo['url'], outfile, True)
 
     def download_image(self, url: str, outfile: str, verbose: bool = False):
         """
@@ -150,16 +239,82 @@ class PhotoListFetcher:
         suffix = Path(outfile).suffix.lower()
         if suffix not in ['.jpg', '.jpeg', '.gif', '.png']:
             raise ValueError(f"Non-JPG filename '{outfile}' ({suffix}) found, aborting as a precaution")
-        response = requests.get(url)
-        content_type = response.headers['Content-Type'].split(';')[0]
-        if content_type.split('/')[0].lower() != 'image':
-            raise ValueError(f"Non-image type ({content_type}) declared by server, aborting as a precaution")
-        open(outfile, 'wb').write(response.content)
+        # Stream to a partial file and rename it into place, so outfile is never left half-written
+        part_file = outfile + '.part'
+
+        def attempt() -> None:
+            try:
+                self.download_to_part_file(url, part_file)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout, IncompleteDownloadError) as err:
+                # Keep what we have; the retry (or next run) resumes from there if the server allows
+                raise RetryableError(f'{url} interrupted: {err}') from err
+
+        self.rate_controller.call(attempt)
+        os.replace(part_file, outfile)
         if verbose:
             print(f'{url} => {outfile}')
         if self.post_download_callback:
             self.post_download_callback(outfile)
 
+    def download_to_part_file(self, url: str, part_file: str) -> None:
+        """
+        Download or continue downloading a URL to a partial file, checking it against the server's reported length.
+        An existing partial file is resumed with a Range request; if the server ignores the range we start again.
+        Only a 200 is taken as a whole file, and only a 206 starting at the end of the partial file as the rest of one.
+        :param url:
+        :param part_file:
+        :return:
+        """
+        offset = Path(part_file).stat().st_size if Path(part_file).exists() else 0
+        # Lengths and ranges count the bytes as sent, but iter_content writes them decoded, so ask for them unencoded
+        headers = {'Accept-Encoding': 'identity', **({'Range': f'bytes={offset}-'} if offset else {})}
+        with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as response:
+            if response.status_code in RETRYABLE_STATUSES:
+                retry_after = response.headers.get('Retry-After', '')
+                raise RetryableError(f'{url}: status {response.status_code}',
+                                     float(retry_after) if retry_after.isdigit() else None)
+            if response.status_code == 416:  # nothing more to fetch from offset, so the partial can't be trusted
+                Path(part_file).unlink()
+                raise IncompleteDownloadError(f'{url}: server refused resume from byte {offset}')
+            response.raise_for_status()
+            content_type = response.headers['Content-Type'].split(';')[0]
+            if content_type.split('/')[0].lower() != 'image':
+                if offset:
+                    Path(part_file).unlink()
+                raise ValueError(f"Non-image type ({content_type}) declared by server, aborting as a precaution")
+
+            if response.status_code == 206:
+                content_range_header = response.headers.get('Content-Range', '')
+                content_range = re.match(r'bytes (\d+)-\d+/(\d+)', content_range_header)
+                if not content_range or int(content_range.group(1)) != offset:
+                    # Not the range we asked for, so it can't be appended; start again on the next attempt
+                    if offset:
+                        Path(part_file).unlink()
+                    raise IncompleteDownloadError(
+                        f'{url}: asked for bytes from {offset}, got range "{content_range_header}"'
+                    )
+                expected_size: Optional[int] = int(content_range.group(2))
+                mode = 'ab'
+            elif response.status_code == 200:
+                expected_size = None  # whole file, whether or not we asked for a range
+                if 'Content-Length' in response.headers:
+                    expected_size = int(response.headers['Content-Length'])
+                mode = 'wb'
+            else:
+                raise ValueError(f'{url}: unexpected status {response.status_code}, aborting as a precaution')
+
+            with open(part_file, mode) as part_fp:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    part_fp.write(chunk)
+                part_fp.flush()
+                os.fsync(part_fp.fileno())
+
+        if expected_size is not None and Path(part_file).stat().st_size != expected_size:
+            raise IncompleteDownloadError(
+                f'{url}: got {Path(part_file).stat().st_size} of {expected_size} bytes'
+            )
+
     @staticmethod
     def remove_local_without_remote(photos: List[Photo], local_dir: str):
         """
@@ -0,0 +1,69 @@
+"""
+Class file for PhotoRecord
+"""
+import sys
+from typing import Any, Mapping
+
+from typing_extensions import TypedDict
+
+PhotoDict = TypedDict('PhotoDict', {'url': str, 'local_file': str, 'title': str, 'taken': str})
+
+
+class PhotoRecord:
+    """
+    Compact stand-in for a Photo dict, for holding scans of very large albums.
+    Fields are read as with a dict, eg photo['title']. Titles repeat a lot, so they're interned.
+    """
+    __slots__ = ('url', 'local_file', 'title', 'taken')
+    url: str
+    local_file: str
+    title: str
+    taken: str
+
+    def __init__(self, url: str, local_file: str, title: str, taken: str) -> None:
+        self.url = url
+        self.local_file = local_file
+        self.title = sys.intern(title)
+        self.taken = taken
+
+    @classmethod
+    def from_dict(cls, photo: Mapping[str, str]) -> 'PhotoRecord':
+        """
+        Convert a Photo dict, eg as read from JSON. Hand-made photo lists may leave out title and taken.
+        :param photo:
+        :return:
+        """
+        return cls(photo['url'], photo['local_file'], photo.get('title', ''), photo.get('taken', ''))
+
+    def to_dict(self) -> PhotoDict:
+        """
+        Convert to a plain Photo dict, eg for JSON export
+        :return:
+        """
+        return {'url': self.url, 'local_file': self.local_file, 'title': self.title, 'taken': self.taken}
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PhotoRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None  # type: ignore  # compared by value, so unhashable like the dicts it replaces
+
+    def __repr__(self) -> str:
+        return f'PhotoRecord({self.to_dict()!r})'
+
+
+def photo_json_default(value: Any) -> PhotoDict:
+    """
+    json.dump default hook to write PhotoRecords as plain Photo dicts
+    :param value:
+    :return:
+    """
+    if isinstance(value, PhotoRecord):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
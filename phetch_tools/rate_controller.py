@@ -0,0 +1,116 @@
+"""
+Class file for RateController
+"""
+import random
+import sys
+import threading
+from time import monotonic, sleep
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryableError(Exception):
+    """
+    A request failed in a way that's worth retrying later, eg throttling or a server error
+    """
+    retry_after: Optional[float]
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateController:
+    """
+    Paces requests to a target rate, which halves on throttling or server errors and creeps back up after a
+    run of successes. Failed requests are retried after a jittered exponential backoff. Thread-safe.
+    """
+    rate: float
+    min_rate: float
+    max_rate: float
+    max_retries: int
+    base_delay = 1.0  # seconds
+    max_delay = 60.0  # seconds
+    ramp_after = 10  # successes in a row before raising the rate
+    ramp_step = 0.25  # proportion of current rate to add
+
+    def __init__(self, rate: float = 10.0, min_rate: float = 0.5, max_rate: float = 50.0,
+                 max_retries: int = 5) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.successes = 0
+        self.next_slot = monotonic()
+        self.lock = threading.Lock()
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call a function at the controlled rate, retrying it while it raises RetryableError
+        :param func:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        attempt = 0
+        while True:
+            self.wait()
+            try:
+                result = func(*args, **kwargs)
+            except RetryableError as err:
+                self.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, err.retry_after)
+                print(f'{err}; retrying in {delay:.1f}s', file=sys.stderr)  # keep stdout clean for scripts' output
+                sleep(delay)
+                attempt += 1
+                continue
+            self.record_success()
+            return result
+
+    def wait(self) -> None:
+        """
+        Block until the next request slot at the current rate
+        :return:
+        """
+        with self.lock:
+            now = monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1 / self.rate
+        if slot > now:
+            sleep(slot - now)
+
+    def record_success(self) -> None:
+        """
+        Note a successful request, raising the rate after enough of them in a row
+        :return:
+        """
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.ramp_after:
+                self.successes = 0
+                self.rate = min(self.max_rate, self.rate * (1 + self.ramp_step))
+
+    def record_failure(self) -> None:
+        """
+        Note a throttled or failed request, halving the rate
+        :return:
+        """
+        with self.lock:
+            self.successes = 0
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Time to wait before retrying; the server's Retry-After if given, else "full jitter" exponential backoff
+        :param attempt: Number of retries already made
+        :param retry_after:
+        :return:
+        """
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
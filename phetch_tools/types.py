@@ -1,4 +1,8 @@
-from typing_extensions import Literal, TypedDict
+from typing import Union
 
-Photo = TypedDict('Photo', {'url': str, 'local_file': str, 'title': str, 'taken': str})
-PhotoKey = Literal['url', 'local_file', 'title', 'taken']
\ No newline at end of file
+from typing_extensions import Literal
+
+from .photo_record import PhotoDict, PhotoRecord
+
+Photo = Union[PhotoDict, PhotoRecord]  # PhotoRecords from scans, dicts from JSON
+PhotoKey = Literal['url', 'local_file', 'title', 'taken']
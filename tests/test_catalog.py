@@ -0,0 +1,89 @@
+"""
+Tests for PhotoCatalog
+"""
+import pytest
+
+from phetch_tools import PhotoCatalog, PhotoIndex, PhotoQuery
+from phetch_tools.photo_record import PhotoRecord
+from phetch_tools.types import Photo
+
+
+def make_photo(photo_id: int, size_suffix: str = 'o') -> Photo:
+    """
+    Photo record as FlickrReader would make it, with a URL for the given size
+    :param photo_id:
+    :param size_suffix:
+    :return:
+    """
+    return PhotoRecord(f'https://live.staticflickr.com/65535/{photo_id}_abc_{size_suffix}.jpg',
+                       f'photo_{photo_id}_{photo_id}.jpg', f'Photo {photo_id}', f'2020-01-{photo_id % 28 + 1:02d}')
+
+
+ALBUM_PHOTO_IDS = {
+    '111': [5, 3, 1, 7, 12],
+    '222': [1, 2, 3, 4, 12],
+    '333': [9, 7, 4, 8, 3],
+    '444': [12, 6, 5, 4],
+}
+
+
+def test_scans_are_kept_per_size() -> None:
+    with PhotoCatalog(':memory:') as catalog:
+        catalog.put('111', 'k', '100', 2, [make_photo(1, 'k'), make_photo(2, 'k')])
+        catalog.put('111', None, '100', 2, [make_photo(1), make_photo(2)])
+
+        large = catalog.get('111', 'k', '100', 2)
+        original = catalog.get('111', None, '100', 2)
+        assert large and [photo['url'] for photo in large] == [make_photo(1, 'k')['url'], make_photo(2, 'k')['url']]
+        assert original and [photo['url'] for photo in original] == [make_photo(1)['url'], make_photo(2)['url']]
+        assert catalog.get('111', 'k', '101', 2) is None
+
+
+def test_any_size_reuses_scan_at_other_size() -> None:
+    with PhotoCatalog(':memory:') as catalog:
+        catalog.put('111', 'k', '100', 2, [make_photo(1, 'k'), make_photo(2, 'k')])
+        assert catalog.get('111', None, '100', 2) is None
+        catalog.any_size = True
+        assert catalog.get('111', None, '100', 2) == [make_photo(1, 'k'), make_photo(2, 'k')]
+        assert catalog.get('111', None, '101', 2) is None
+
+
+def test_photo_info_is_dropped_when_photo_changes() -> None:
+    def info(last_update: str) -> dict:
+        return {'photo': {'id': '1', 'dates': {'lastupdate': last_update}}}
+
+    with PhotoCatalog(':memory:') as catalog:
+        catalog.update_photo_info('1', info('100'))
+        catalog.put_photo_info('1', 'getSizes', {'sizes': 'old'})
+        catalog.update_photo_info('1', info('100'))
+        assert catalog.get_photo_info('1', 'getSizes') == {'sizes': 'old'}
+
+        catalog.update_photo_info('1', info('200'))
+        assert catalog.get_photo_info('1', 'getSizes') is None
+        assert catalog.get_photo_info('1', 'getInfo') == info('200')
+
+
+@pytest.mark.parametrize('query', [
+    '111',
+    '111 & 222',
+    '222 & 111',
+    '111 | 222 | 333',
+    '333 | 111 - 222',
+    '(333 | 111) AND NOT 222',
+    '222 & (111 | 333) | 444 - 111',
+    '(444 | (111 & 333)) | (222 - (333 | 111))',
+])
+def test_find_photos_matches_query_evaluate(query: str) -> None:
+    albums = {album_id: [make_photo(photo_id) for photo_id in photo_ids]
+              for album_id, photo_ids in ALBUM_PHOTO_IDS.items()}
+    with PhotoCatalog(':memory:') as catalog:
+        for album_id, photos in albums.items():
+            catalog.put(album_id, None, '100', len(photos), photos)
+        expected = PhotoQuery(query).evaluate({album_id: PhotoIndex(photos) for album_id, photos in albums.items()})
+        assert catalog.find_photos(PhotoQuery(query)) == expected.to_list()
+
+
+def test_find_photos_taken_since() -> None:
+    with PhotoCatalog(':memory:') as catalog:
+        catalog.put('111', None, '100', 3, [make_photo(5), make_photo(3), make_photo(1)])
+        assert catalog.find_photos(PhotoQuery('111'), '2020-01-04') == [make_photo(5), make_photo(3)]
@@ -0,0 +1,70 @@
+"""
+Tests for list_overlaps' title-gap scheduling
+"""
+import random
+from typing import Dict, List
+
+import pytest
+
+from list_overlaps import schedule_title_gap
+from phetch_tools.photo_record import PhotoRecord
+from phetch_tools.types import Photo
+
+
+def make_photos(counts: Dict[str, int]) -> List[Photo]:
+    """
+    Photos for each title, numbered in order within the title, then shuffled
+    :param counts: Number of photos for each title
+    :return:
+    """
+    photos: List[Photo] = [PhotoRecord(f'https://example.com/{title}{number}.jpg', f'{title}_{number}.jpg', title, '')
+                           for title, count in counts.items() for number in range(count)]
+    random.Random(1).shuffle(photos)
+    return photos
+
+
+def title_gaps(schedule: List[Photo]) -> Dict[str, List[int]]:
+    """
+    Days between successive photos of each title
+    :param schedule:
+    :return:
+    """
+    days: Dict[str, List[int]] = {}
+    for day, photo in enumerate(schedule):
+        days.setdefault(photo['title'], []).append(day)
+    return {title: [later - earlier for earlier, later in zip(title_days, title_days[1:])]
+            for title, title_days in days.items()}
+
+
+@pytest.mark.parametrize('counts, min_gap', [
+    ({'A': 3, 'B': 3, 'C': 3, 'D': 3, 'E': 3}, 4),
+    ({'A': 6, 'B': 3, 'C': 3, 'D': 1, 'E': 1, 'F': 1, 'G': 1}, 5),
+    ({'A': 10, 'B': 1, 'C': 1}, 30),
+])
+def test_titles_keep_their_order(counts: Dict[str, int], min_gap: int) -> None:
+    photos = make_photos(counts)
+    schedule = schedule_title_gap(photos, min_gap)
+    assert sorted(schedule, key=lambda photo: photo['local_file']) == \
+        sorted(photos, key=lambda photo: photo['local_file'])
+    for title in counts:
+        assert [photo for photo in schedule if photo['title'] == title] == \
+            [photo for photo in photos if photo['title'] == title]
+
+
+def test_min_gap_is_kept_where_possible() -> None:
+    counts = {'A': 3, 'B': 3, 'C': 3, 'D': 3, 'E': 3, 'F': 2, 'G': 1, 'H': 1}
+    for title, gaps in title_gaps(schedule_title_gap(make_photos(counts), 5)).items():
+        assert all(gap >= 5 for gap in gaps), title
+
+
+def test_crowded_titles_are_spread_evenly() -> None:
+    # A has 6 of 19 photos, too many to keep 5 days apart, so it comes every third day; B and C still keep the gap
+    counts = {'A': 6, 'B': 3, 'C': 3, 'D': 1, 'E': 1, 'F': 1, 'G': 1, 'H': 1, 'I': 1, 'J': 1}
+    gaps = title_gaps(schedule_title_gap(make_photos(counts), 5))
+    assert gaps['A'] == [3] * 5
+    assert all(gap >= 5 for gap in gaps['B'] + gaps['C'])
+
+
+def test_title_filling_the_schedule_alternates() -> None:
+    gaps = title_gaps(schedule_title_gap(make_photos({'A': 10, 'B': 5, 'C': 5}), 30))
+    assert gaps['A'] == [2] * 9
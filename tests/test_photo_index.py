@@ -0,0 +1,92 @@
+"""
+Tests for PhotoIndex and PhotoQuery
+"""
+from typing import Dict, List
+
+import pytest
+
+from phetch_tools import PhotoIndex, PhotoQuery
+from phetch_tools.photo_record import PhotoRecord
+from phetch_tools.types import Photo
+
+
+def make_photos(*photo_ids: int) -> List[Photo]:
+    """
+    Photos with the given Flickr IDs, in order
+    :param photo_ids:
+    :return:
+    """
+    return [PhotoRecord(f'https://example.com/{photo_id}.jpg', f'photo_{photo_id}.jpg', f'Photo {photo_id}', '')
+            for photo_id in photo_ids]
+
+
+def ids(index: PhotoIndex) -> List[str]:
+    """
+    Flickr IDs of an index's photos, in order
+    :param index:
+    :return:
+    """
+    return [PhotoIndex.photo_id(photo) for photo in index]
+
+
+ALBUMS: Dict[str, PhotoIndex] = {
+    '111': PhotoIndex(make_photos(5, 3, 1, 7)),
+    '222': PhotoIndex(make_photos(1, 2, 3, 4)),
+    '333': PhotoIndex(make_photos(9, 7, 4, 8)),
+}
+
+
+def test_set_operations_keep_left_operand_order() -> None:
+    assert ids(ALBUMS['111'] & ALBUMS['222']) == ['3', '1']
+    assert ids(ALBUMS['222'] & ALBUMS['111']) == ['1', '3']
+    assert ids(ALBUMS['111'] | ALBUMS['222']) == ['5', '3', '1', '7', '2', '4']
+    assert ids(ALBUMS['111'] - ALBUMS['222']) == ['5', '7']
+
+
+def test_repeated_photo_is_indexed_once() -> None:
+    assert ids(PhotoIndex(make_photos(1, 2, 1))) == ['1', '2']
+
+
+@pytest.mark.parametrize('query, tree', [
+    ('111 | 222 & 333', ('|', '111', ('&', '222', '333'))),
+    ('111 & 222 | 333', ('|', ('&', '111', '222'), '333')),
+    ('111 | 222 - 333', ('|', '111', ('-', '222', '333'))),
+    ('111 - 222 & 333', ('&', ('-', '111', '222'), '333')),
+    ('(111 | 222) & 333', ('&', ('|', '111', '222'), '333')),
+])
+def test_precedence(query: str, tree) -> None:
+    assert PhotoQuery(query).tree == tree
+
+
+@pytest.mark.parametrize('query, symbols', [
+    ('111 and 222 or 333', '111 & 222 | 333'),
+    ('111 AND NOT 222', '111 - 222'),
+    ('111 not 222', '111 - 222'),
+    ('111 Or (222 AND not 333)', '111 | (222 - 333)'),
+])
+def test_word_operators(query: str, symbols: str) -> None:
+    assert PhotoQuery(query).tree == PhotoQuery(symbols).tree
+
+
+def test_album_ids_in_order_of_first_appearance() -> None:
+    assert PhotoQuery('333 & (111 | 333) - 222').album_ids == ['333', '111', '222']
+
+
+@pytest.mark.parametrize('query, message', [
+    ('111 XOR 222', 'Unknown operator "XOR"'),
+    ('(111 | 222', 'Missing "\\)"'),
+    ('111 | 222)', 'Unexpected "\\)"'),
+    ('111 &', 'found end'),
+    ('& 111', 'found &'),
+    ('111 222', 'Unexpected "222"'),
+    ('', 'found end'),
+])
+def test_bad_queries(query: str, message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        PhotoQuery(query)
+
+
+def test_evaluate_keeps_left_operand_order() -> None:
+    assert ids(PhotoQuery('222 & (111 | 333)').evaluate(ALBUMS)) == ['1', '3', '4']
+    assert ids(PhotoQuery('333 | 111 - 222').evaluate(ALBUMS)) == ['9', '7', '4', '8', '5']
+    assert ids(PhotoQuery('(333 | 111) AND NOT 222').evaluate(ALBUMS)) == ['9', '7', '8', '5']
@@ -0,0 +1,31 @@
+"""
+Tests for reading photo lists
+"""
+import pytest
+
+from phetch_tools.photo_list import iter_photo_list
+from phetch_tools.photo_record import PhotoRecord
+
+
+def test_title_and_taken_are_optional() -> None:
+    lines = ['{"url": "https://example.com/1.jpg", "local_file": "one_1.jpg"}']
+    assert list(iter_photo_list(lines)) == [PhotoRecord('https://example.com/1.jpg', 'one_1.jpg', '', '')]
+
+
+def test_json_array_is_read_whole() -> None:
+    lines = ['[{"url": "https://example.com/1.jpg", "local_file": "one_1.jpg", "title": "One",',
+             '"taken": "2020-01-01 10:00:00"}]']
+    assert list(iter_photo_list(lines)) == [
+        PhotoRecord('https://example.com/1.jpg', 'one_1.jpg', 'One', '2020-01-01 10:00:00')
+    ]
+
+
+@pytest.mark.parametrize('lines, message', [
+    (['{"url": "https://example.com/1.jpg", "local_file": "one_1.jpg"}', '', '{"url": "https://example.com/2.jpg"}'],
+     "line 3 has no 'local_file'"),
+    (['[{"url": "https://example.com/1.jpg", "local_file": "one_1.jpg"}, {"local_file": "two_2.jpg"}]'],
+     "entry 2 has no 'url'"),
+])
+def test_missing_required_field_names_position(lines, message) -> None:
+    with pytest.raises(ValueError, match=message):
+        list(iter_photo_list(lines))
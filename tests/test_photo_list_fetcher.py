@@ -0,0 +1,177 @@
+"""
+Tests for PhotoListFetcher downloads, against a local HTTP stand-in for the image server
+"""
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pytest
+
+from phetch_tools import PhotoListFetcher, PhotoRecord, RateController
+from phetch_tools.rate_controller import RetryableError
+
+IMAGE = bytes(range(256)) * 1200  # 300 KiB stand-in "JPEG"
+
+
+class ImageServer(ThreadingHTTPServer):
+    """
+    Serves IMAGE at any path, handling Range requests according to range_mode:
+    honour, ignore (always 200), refuse (416), wrong_start (206 from the wrong byte)
+    or truncate_once (first ranged 206 stops short). Whole files are gzipped for clients that accept it.
+    """
+    range_mode = 'honour'
+    range_headers: List[str]
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for ImageServer
+    """
+    server: ImageServer
+
+    def log_message(self, *args) -> None:  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """
+        Serve the image, or part of it
+        :return:
+        """
+        range_header = self.headers.get('Range')
+        mode = self.server.range_mode
+        if range_header is None or mode == 'ignore':
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                self.send_body(200, gzip.compress(IMAGE), {'Content-Encoding': 'gzip'})
+            else:
+                self.send_body(200, IMAGE, {})
+            return
+        self.server.range_headers.append(range_header)
+        if mode == 'refuse':
+            self.send_body(416, b'', {'Content-Range': f'bytes */{len(IMAGE)}'})
+            return
+        start = int(range_header[len('bytes='):-len('-')])
+        if mode == 'wrong_start':
+            start -= 1000
+        body = IMAGE[start:]
+        if mode == 'truncate_once':
+            self.server.range_mode = 'honour'
+            body = body[:len(body) // 2]
+        self.send_body(206, body, {'Content-Range': f'bytes {start}-{len(IMAGE) - 1}/{len(IMAGE)}'})
+
+    def send_body(self, status: int, body: bytes, headers: Dict[str, str]) -> None:
+        """
+        Send a complete response
+        :param status:
+        :param body:
+        :param headers:
+        :return:
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(name='server')
+def fixture_server() -> Iterator[ImageServer]:
+    server = ImageServer(('127.0.0.1', 0), ImageHandler)
+    server.range_headers = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name='fetcher')
+def fixture_fetcher() -> PhotoListFetcher:
+    rate_controller = RateController(rate=1000.0, max_rate=1000.0)
+    rate_controller.base_delay = 0.01
+    return PhotoListFetcher().set_rate_controller(rate_controller).set_timeout(5)
+
+
+def download_with_partial(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> Path:
+    """
+    Download IMAGE with the first 100,000 bytes already in a partial file
+    :param server:
+    :param fetcher:
+    :param tmp_path:
+    :return: Downloaded file
+    """
+    outfile = tmp_path / 'photo.jpg'
+    Path(str(outfile) + '.part').write_bytes(IMAGE[:100000])
+    fetcher.download_image(f'http://127.0.0.1:{server.server_address[1]}/photo.jpg', str(outfile))
+    return outfile
+
+
+def test_download_without_partial(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    outfile = tmp_path / 'photo.jpg'
+    fetcher.download_image(f'http://127.0.0.1:{server.server_address[1]}/photo.jpg', str(outfile))
+    assert outfile.read_bytes() == IMAGE
+    assert not server.range_headers
+
+
+def test_resume_with_ranges(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    outfile = download_with_partial(server, fetcher, tmp_path)
+    assert outfile.read_bytes() == IMAGE
+    assert server.range_headers == ['bytes=100000-']
+    assert not Path(str(outfile) + '.part').exists()
+
+
+def test_server_ignoring_range(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    server.range_mode = 'ignore'
+    assert download_with_partial(server, fetcher, tmp_path).read_bytes() == IMAGE
+
+
+def test_server_refusing_range(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    server.range_mode = 'refuse'
+    assert download_with_partial(server, fetcher, tmp_path).read_bytes() == IMAGE
+    assert server.range_headers == ['bytes=100000-']  # then started again without a range
+
+
+def test_range_from_wrong_start(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    server.range_mode = 'wrong_start'
+    assert download_with_partial(server, fetcher, tmp_path).read_bytes() == IMAGE
+    assert server.range_headers == ['bytes=100000-']
+
+
+def test_truncated_range_is_resumed(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    server.range_mode = 'truncate_once'
+    assert download_with_partial(server, fetcher, tmp_path).read_bytes() == IMAGE
+    assert len(server.range_headers) == 2 and server.range_headers[0] == 'bytes=100000-'
+    assert int(server.range_headers[1][len('bytes='):-len('-')]) > 100000
+
+
+def test_persistent_wrong_range_is_never_committed(server: ImageServer, fetcher: PhotoListFetcher,
+                                                   tmp_path: Path) -> None:
+    server.range_mode = 'wrong_start'
+    outfile = tmp_path / 'photo.jpg'
+    part_file = Path(str(outfile) + '.part')
+    part_file.write_bytes(IMAGE[:100000])
+    # Each wrong range discards the partial file, so the retry fetches the whole file; force ranges every time
+    # by putting the partial back before each attempt
+    original = fetcher.download_to_part_file
+
+    def download_with_fresh_partial(url: str, part: str) -> None:
+        if not Path(part).exists():
+            Path(part).write_bytes(IMAGE[:100000])
+        original(url, part)
+
+    fetcher.download_to_part_file = download_with_fresh_partial  # type: ignore
+    with pytest.raises(RetryableError):
+        fetcher.download_image(f'http://127.0.0.1:{server.server_address[1]}/photo.jpg', str(outfile))
+    assert not outfile.exists()
+
+
+def test_repeated_files_are_fetched_once(server: ImageServer, fetcher: PhotoListFetcher, tmp_path: Path) -> None:
+    downloaded: List[str] = []
+    fetcher.set_jobs(3).set_post_download_callback(downloaded.append)
+    url = f'http://127.0.0.1:{server.server_address[1]}/photo.jpg'
+    photos = [PhotoRecord(url, f'photo_{index % 4}.jpg', '', '') for index in range(40)]
+    fetcher.fetch_photos(photos, str(tmp_path))
+    assert sorted(downloaded) == [str(tmp_path / f'photo_{index}.jpg') for index in range(4)]
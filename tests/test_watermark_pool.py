@@ -0,0 +1,35 @@
+"""
+Tests for WatermarkPool error reporting
+"""
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from image_processors import WatermarkPool
+
+
+def make_pool(tmp_path: Path) -> WatermarkPool:
+    """
+    Single-worker pool with a plain watermark
+    :param tmp_path:
+    :return:
+    """
+    watermark_file = str(tmp_path / 'watermark.png')
+    Image.new('RGBA', (400, 100), (255, 255, 255, 200)).save(watermark_file)
+    return WatermarkPool(watermark_file, workers=1)
+
+
+def test_close_raises_failed_task(tmp_path: Path) -> None:
+    pool = make_pool(tmp_path)
+    pool.submit(str(tmp_path / 'missing.jpg'))
+    with pytest.raises(FileNotFoundError):
+        pool.close()
+
+
+def test_exit_keeps_error_in_progress(tmp_path: Path) -> None:
+    with pytest.raises(RuntimeError, match='download failed'):
+        with make_pool(tmp_path) as pool:
+            pool.submit(str(tmp_path / 'missing.jpg'))
+            raise RuntimeError('download failed')
+    assert isinstance(pool.error, FileNotFoundError)
@@ -0,0 +1,87 @@
+"""
+Tests for Watermarker
+"""
+import shutil
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from image_processors import Watermarker, jpegtran
+
+
+def make_watermarker(tmp_path: Path) -> Watermarker:
+    """
+    Watermarker with a plain white-on-transparent watermark
+    :param tmp_path:
+    :return:
+    """
+    watermark_file = str(tmp_path / 'watermark.png')
+    Image.new('RGBA', (400, 100), (255, 255, 255, 200)).save(watermark_file)
+    return Watermarker(watermark_file)
+
+
+def make_source(source_file: str, size=(4000, 3000), **options) -> None:
+    """
+    Save a photo-like JPEG: smooth detail over a gradient, with EXIF
+    :param source_file:
+    :param size:
+    :param options: Options for Image.save, eg subsampling
+    :return:
+    """
+    exif = Image.Exif()
+    exif[0x010F] = 'Test'  # Make; standard_save carries EXIF across, so sources need some
+    detail = Image.effect_noise((size[0] // 16, size[1] // 16), 60).resize(size).filter(ImageFilter.GaussianBlur(3))
+    gradient = Image.linear_gradient('L').resize(size)
+    Image.merge('RGB', [detail, gradient, detail.transpose(Image.FLIP_LEFT_RIGHT)]).save(
+        source_file, quality=90, exif=exif, **options)
+
+
+def test_renditions_in_mixed_order_get_their_own_sizes(tmp_path: Path) -> None:
+    source_file = str(tmp_path / 'source.jpg')
+    make_source(source_file)
+    renditions = [(1024, str(tmp_path / 'a.jpg')), (None, str(tmp_path / 'b.jpg')), (2048, str(tmp_path / 'c.jpg'))]
+
+    make_watermarker(tmp_path).copy_with_watermark_renditions(source_file, renditions)
+
+    sizes = {Path(output_file).name: Image.open(output_file).size for _, output_file in renditions}
+    assert sizes == {'a.jpg': (1024, 768), 'b.jpg': (4000, 3000), 'c.jpg': (2048, 1536)}
+
+
+@pytest.mark.skipif(jpegtran.find_jpegtran() is None, reason='needs jpegtran with -drop')
+@pytest.mark.parametrize('subsampling', [0, 1, 2])
+def test_lossless_watermark_only_changes_corner(tmp_path: Path, subsampling: int) -> None:
+    source_file = str(tmp_path / 'source.jpg')
+    make_source(source_file, (3001, 2007), subsampling=subsampling)  # not whole MCUs
+    lossless_file = str(tmp_path / 'lossless.jpg')
+    full_file = str(tmp_path / 'full.jpg')
+    shutil.copy(source_file, lossless_file)
+    shutil.copy(source_file, full_file)
+    watermarker = make_watermarker(tmp_path)
+    assert watermarker.set_lossless(True)
+
+    watermarker.mark_in_place(lossless_file)
+    make_watermarker(tmp_path).mark_in_place(full_file)
+
+    source, lossless, full = (Image.open(file) for file in (source_file, lossless_file, full_file))
+    assert lossless.info['exif'] == source.info['exif']
+    assert 'lossless' in watermarker.encode_stats.totals
+    (left, top), _, _ = watermarker.calculate_lossless_corner(source)
+    # Chroma upsampling reads one pixel into neighbouring blocks, so skip the edge next to the corner
+    for box in ((0, 0, source.width, top - 1), (0, 0, left - 1, source.height)):
+        assert ImageChops.difference(source.crop(box), lossless.crop(box)).getbbox() is None
+    corner = (left, top) + source.size
+    difference = ImageStat.Stat(ImageChops.difference(lossless.crop(corner), full.crop(corner)))
+    assert max(difference.mean) < 3
+
+
+def test_smaller_renditions_are_scaled_from_clean_image(tmp_path: Path) -> None:
+    source_file = str(tmp_path / 'source.jpg')
+    make_source(source_file)
+    watermarker = make_watermarker(tmp_path)
+    one_pass = str(tmp_path / 'one_pass.jpg')
+    watermarker.copy_with_watermark_renditions(source_file, [(None, str(tmp_path / 'full.jpg')), (1024, one_pass)])
+    alone = str(tmp_path / 'alone.jpg')
+    watermarker.copy_with_watermark_renditions(source_file, [(1024, alone)])
+    # Had the full-size watermark been scaled down with the image, the small rendition would carry two
+    assert ImageChops.difference(Image.open(one_pass), Image.open(alone)).getbbox() is None